@@ -191,7 +191,7 @@ class CNXDataset(Dataset):
     def __getitem__(self, idx):
         idx = self.shuffle_idx_list[idx]
         input_ids = self.sentences[idx] + ['[SEP]'] + self.prompt_inputs[idx]
-        input_ids = [self.data_manager.wordToIdx(word) for word in input_ids]
+        input_ids = self.data_manager.wordsToIdx(input_ids)
         input_ids = [101] + input_ids
 
         labels = [-100 for _ in input_ids]
@@ -201,7 +201,7 @@ class CNXDataset(Dataset):
 
         origin_labels = [_ for _ in input_ids]
         if len(self.prompt_origin_labels[idx]) > 0:
-            prompt_origin_labels = [self.data_manager.wordToIdx(word) for word in self.prompt_origin_labels[idx]]
+            prompt_origin_labels = self.data_manager.wordsToIdx(self.prompt_origin_labels[idx])
             origin_labels[-len(prompt_origin_labels):] = prompt_origin_labels
 
         token_type_ids = [0 for _ in input_ids]
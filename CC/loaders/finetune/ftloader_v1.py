@@ -1,23 +1,27 @@
-from functools import lru_cache
+from functools import partial
 import json
-from typing import Any, Dict, List, Union
+import numpy as np
+from typing import Any, Dict, List, Tuple
 import torch
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import BatchSampler, DataLoader, Dataset, SequentialSampler
 from transformers.utils.dummy_pt_objects import BertModel
-from CC.loaders.utils.cache_manager import FileCache
+from CC.loaders.utils.cache_manager import ArtifactCache, FileCache
+from CC.loaders.utils.char_table import CharIdTable
+from CC.loaders.utils.collate import collate_batch
+from CC.loaders.utils.dataset_store import DatasetStore, map_ordered
 from CC.loaders.utils.embedding import VocabEmbedding
 from CC.loaders.utils.lexicon_factory import TrieFactory
 from CC.loaders.utils.lexicon_tree import Trie
 from CC.loaders.utils.parser import KwargsParser
+from CC.loaders.utils.prefetch import PrefetchDataset, PrefetchSampler
 from CC.loaders.utils.reader import FileReader
+from CC.loaders.utils.sampler import BucketBatchSampler
 from CC.loaders.utils.vocab import Vocab
 from transformers import BertTokenizer, BertModel
 from ICCSupervised.ICCSupervised import IDataLoader
 import random
 from torch import tensor
 from tqdm import tqdm
-import tempfile
-import threading
 
 
 
@@ -32,6 +36,8 @@ class FTLoaderV1(IDataLoader):
             .add_argument("eval_batch_size", int, defaultValue=16) \
             .add_argument("test_batch_size", int, defaultValue=16) \
             .add_argument("word_embedding_file", str) \
+            .add_argument("word_embedding_store", str, optional=True) \
+            .add_argument("embedding_dtype", str, defaultValue="float32") \
             .add_argument("word_vocab_file", str) \
             .add_argument("train_file", str) \
             .add_argument("eval_file", str) \
@@ -43,6 +49,15 @@ class FTLoaderV1(IDataLoader):
             .add_argument("external_entities_file",str) \
             .add_argument("output_eval", bool, defaultValue=False) \
             .add_argument("max_scan_num", int, defaultValue=1000000) \
+            .add_argument("use_double_array_trie", bool, defaultValue=False) \
+            .add_argument("num_processes", int, defaultValue=1) \
+            .add_argument("label_batch_size", int, defaultValue=32, description="label sentences per encoder pass") \
+            .add_argument("label_num_threads", int, optional=True, description="torch threads of the label sentence encoder") \
+            .add_argument("prefetch_depth", int, defaultValue=0, description="training samples loaded ahead by threads, 0 to disable") \
+            .add_argument("prefetch_threads", int, defaultValue=2) \
+            .add_argument("cache_max_size", int, optional=True, description="maximum bytes of ./temp/artifacts") \
+            .add_argument("shared_cache_dir", str, optional=True, description="shared memory tier, e.g. /dev/shm/cc_artifacts") \
+            .add_argument("cache_fingerprint", str, defaultValue="etag", description="etag: md5 of the data files, hashed once per version, fast: size, mtime, inode and sampled blocks") \
             .add_argument("add_seq_vocab", bool, defaultValue=False) \
             .add_argument("max_seq_length", int, defaultValue=256) \
             .add_argument("max_word_num", int, defaultValue=5) \
@@ -51,6 +66,10 @@ class FTLoaderV1(IDataLoader):
             .add_argument("use_test", bool, defaultValue=False) \
             .add_argument("do_shuffle", bool, defaultValue=False) \
             .add_argument("do_predict", bool, defaultValue=False) \
+            .add_argument("dynamic_padding", bool, defaultValue=False, description="trim batches to their longest sequence") \
+            .add_argument("bucket_batches", bool, defaultValue=False, description="batch training samples of similar length") \
+            .add_argument("max_tokens", int, optional=True, description="padded tokens per bucketed batch instead of batch_size") \
+            .add_argument("seed", int, defaultValue=0) \
             .add_argument("lexicon_tree_cache_path", str, optional=True) \
             .add_argument("word_vacab_cache_path", str, optional=True) \
             .add_argument("task_name", str) \
@@ -58,16 +77,7 @@ class FTLoaderV1(IDataLoader):
             .add_argument("debug", bool, defaultValue=False) \
             .parse(self, **kwargs)
 
-        # get cache_key
-        files = [
-            self.train_file, self.eval_file, self.test_file, self.tag_file
-        ]
-        self.cache_key = [
-            FileReader(file).etag() if file is not None else "None"
-            for file in files
-        ]
-        self.cache_key = "_".join(self.cache_key)
-        self.cache = FileCache(f"./temp/{self.cache_key}")
+        self.cache = ArtifactCache(max_size=self.cache_max_size, shared_dir=self.shared_cache_dir, fingerprint=self.cache_fingerprint)
 
         self.read_data_set()
         self.process_data(self.batch_size, self.eval_batch_size,
@@ -78,7 +88,7 @@ class FTLoaderV1(IDataLoader):
             self.train_file, self.eval_file, self.test_file
         ]
 
-        cache = self.cache.group(self.max_scan_num)
+        cache = self.cache
 
         self.tokenizer = BertTokenizer.from_pretrained(self.bert_pretrain_path)
         self.encoder_model = BertModel.from_pretrained(self.bert_pretrain_path,output_hidden_states=True)
@@ -87,19 +97,28 @@ class FTLoaderV1(IDataLoader):
         with open(self.external_entities_file, "r", encoding="utf-8") as f:
             self.external_entities = json.load(f)
 
-        self.lexicon_tree = cache.load(
-            "lexicon_tree", lambda: TrieFactory.get_trie_from_vocabs(
-                [self.word_vocab_file], self.max_scan_num))
+        if self.use_double_array_trie:
+            self.lexicon_tree = TrieFactory.get_double_array_trie_from_vocabs(
+                [self.word_vocab_file], self.max_scan_num, cache.group(
+                    "lexicon_tree", paths=[self.word_vocab_file],
+                    params={"max_scan_num": self.max_scan_num, "double_array": True}).root)
+        else:
+            self.lexicon_tree = cache.load(
+                "lexicon_tree", lambda: TrieFactory.get_trie_from_vocabs(
+                    [self.word_vocab_file], self.max_scan_num),
+                paths=[self.word_vocab_file], params={"max_scan_num": self.max_scan_num})
 
         self.matched_words = cache.load(
             "matched_words",
             lambda: TrieFactory.get_all_matched_word_from_dataset(
-                self.data_files, self.lexicon_tree))
+                self.data_files, self.lexicon_tree, self.num_processes),
+            files=self.data_files, deps=["lexicon_tree"])
 
         self.word_vocab: Vocab = cache.load(
             "word_vocab", lambda: Vocab().from_list(
-                self.matched_words, is_word=True, has_default=False, unk_num=5)
-        )
+                self.matched_words, is_word=True, has_default=False, unk_num=5),
+            deps=["matched_words"])
+        self.lexicon_tree.set_word_ids(self.word_vocab)
 
         self.entity_tag_vocab: Vocab = Vocab().from_files(
             [self.tag_embedding_file], is_word=False, skip=1)
@@ -107,42 +126,97 @@ class FTLoaderV1(IDataLoader):
         # setup matched_word sentence embedding
         def label_load():
             word_label_embedding = {}
-            word_label_embedding_dim = 200
-            for word, idx in tqdm(self.word_vocab.item2idx.items(),
-                                  desc="generate label embedding"):
+            pairs = []
+            for word, idx in self.word_vocab.item2idx.items():
                 word_key = str(list(word))
                 if word_key in self.external_entities["entities"]:
                     word_label_embedding[idx] = {}
                     for label, sentences in self.external_entities["entities"][
                             word_key]["labels"].items():
-                        sentence = sentences[0]
-                        encoding = self.tokenizer.encode_plus(
-                            sentence["text"][:(
-                                509 -
-                                len(f"{word}是一个{self.tag_rules[label]}"))],
-                            f"{word}是一个{self.tag_rules[label]}")
-                        with torch.no_grad():
-                            it = dict((k, torch.tensor(v).unsqueeze(0))
-                                      for k, v in encoding.items())
-                            output = self.encoder_model(**it)
-                            embedding = output.hidden_states[-3][0][0]
-                            word_label_embedding_dim = len(embedding)
-                        word_label_embedding[idx][
-                            self.entity_tag_vocab.token2id(
-                                label)] = embedding.tolist()
+                        prompt = f"{word}是一个{self.tag_rules[label]}"
+                        text = sentences[0]["text"][:(509 - len(prompt))]
+                        pairs.append((idx, self.entity_tag_vocab.token2id(label),
+                                      (text if isinstance(text, str) else tuple(text), prompt)))
+            embeddings = self.encode_label_sentences([sentence for _, _, sentence in pairs])
+            for idx, tag, sentence in pairs:
+                word_label_embedding[idx][tag] = embeddings[sentence]
+            word_label_embedding_dim = len(next(iter(embeddings.values()))) if len(embeddings) > 0 else 200
             return word_label_embedding, word_label_embedding_dim
 
         self.word_label_embedding, self.word_label_embedding_dim = cache.load(
-            "label_embedding_entities", lambda: label_load())
+            "label_embedding_entities", lambda: label_load(),
+            paths=[self.external_entities_file, self.tag_embedding_file], params={"bert_pretrain_path": self.bert_pretrain_path, "tag_rules": self.tag_rules}, deps=["word_vocab"])
+        self.label_pair_ids, self.label_pair_embedding = self.build_label_pairs()
 
         self.tag_vocab: Vocab = Vocab().from_files([self.tag_file],
                                                    is_word=False)
 
         self.vocab_embedding, self.embedding_dim = cache.load(
             "vocab_embedding",
-            lambda: VocabEmbedding(self.word_vocab).build_from_file(
-                self.word_embedding_file, self.max_scan_num, self.add_seq_vocab
-            ).get_embedding())
+            lambda: VocabEmbedding(self.word_vocab, self.embedding_dtype).build_from_file(
+                self.word_embedding_file, self.max_scan_num, self.add_seq_vocab, self.word_embedding_store, self.num_processes
+            ).get_embedding(),
+            paths=[self.word_embedding_file], params={"max_scan_num": self.max_scan_num, "add_seq_vocab": self.add_seq_vocab, "embedding_dtype": self.embedding_dtype}, deps=["word_vocab"])
+
+    def encode_label_sentences(self, sentences: List[Tuple[Any, str]]) -> Dict[Tuple[Any, str], List[float]]:
+        """[CLS] embedding of the third last hidden layer of each (text, prompt) pair, every distinct pair
+        is encoded once. pairs are tokenized in num_processes worker processes, then sorted by length
+        and encoded label_batch_size at a time, padded to the longest pair of the batch. the encoder
+        passes use label_num_threads torch threads
+
+        Args:
+            sentences (List[Tuple[Any, str]]): (text, prompt) pairs, text is a string or a tuple of tokens
+
+        Returns:
+            Dict[Tuple[Any, str], List[float]]: embedding of each pair
+        """
+        sentences = list(dict.fromkeys(sentences))
+        encodings = list(tqdm(map_ordered(partial(_encode_label_sentence, self.tokenizer), sentences, self.num_processes),
+                              desc="tokenize label sentences", total=len(sentences)))
+        order = sorted(range(len(sentences)), key=lambda i: len(encodings[i]["input_ids"]))
+        names = ["input_ids", "token_type_ids", "attention_mask"]
+        embeddings = {}
+        num_threads = torch.get_num_threads()
+        if self.label_num_threads is not None:
+            torch.set_num_threads(self.label_num_threads)
+        try:
+            for start in tqdm(range(0, len(order), self.label_batch_size), desc="generate label embedding"):
+                indexes = order[start:start + self.label_batch_size]
+                length = max(len(encodings[i]["input_ids"]) for i in indexes)
+                it = {name: torch.zeros(len(indexes), length, dtype=torch.long) for name in names}
+                for row, i in enumerate(indexes):
+                    for name in names:
+                        it[name][row, :len(encodings[i][name])] = torch.tensor(encodings[i][name])
+                with torch.no_grad():
+                    output = self.encoder_model(**it)
+                for i, embedding in zip(indexes, output.hidden_states[-3][:, 0].tolist()):
+                    embeddings[sentences[i]] = embedding
+        finally:
+            torch.set_num_threads(num_threads)
+        return embeddings
+
+    def build_label_pairs(self) -> Tuple[Dict[Tuple[int, int], int], np.ndarray]:
+        """number the (word_id, entity_tag_id) pairs of word_label_embedding, the datasets store the
+        pair ids and the model gathers the embeddings from one shared table
+
+        Returns:
+            Tuple[Dict[Tuple[int, int], int], np.ndarray]: pair ids from 1, table [num_pairs + 1, dim] with row 0 zeros
+        """
+        label_pair_ids = {}
+        for word_id, tags in self.word_label_embedding.items():
+            for tag in tags:
+                label_pair_ids[(word_id, tag)] = len(label_pair_ids) + 1
+        label_pair_embedding = np.zeros((len(label_pair_ids) + 1, self.word_label_embedding_dim), dtype=np.float32)
+        for (word_id, tag), pair_id in label_pair_ids.items():
+            label_pair_embedding[pair_id] = self.word_label_embedding[word_id][tag]
+        return label_pair_ids, label_pair_embedding
+
+    def dataset_cache(self, file: str) -> FileCache:
+        return self.cache.group(
+            "dataset", files=[file, self.tag_file], paths=[self.bert_pretrain_path],
+            params={"max_seq_length": self.max_seq_length, "max_word_num": self.max_word_num, "max_label_num": self.max_label_num,
+                    "default_tag": self.default_tag},
+            deps=["word_vocab", "label_embedding_entities"])
 
     def process_data(self,
                      batch_size: int,
@@ -154,11 +228,13 @@ class FTLoaderV1(IDataLoader):
                 self.word_vocab, self.tag_vocab, self.max_word_num,
                 self.max_seq_length, self.default_tag, self.entity_tag_vocab,
                 self.external_entities, self.max_label_num,
-                self.word_label_embedding, self.word_label_embedding_dim,
+                self.label_pair_ids,
                 do_predict=self.do_predict,
-                cache=self.cache)
+                cache=self.dataset_cache(self.data_files[2]),
+                num_processes=self.num_processes)
             self.dataiter_test = DataLoader(self.myData_test,
-                                            batch_size=test_batch_size)
+                                            batch_size=test_batch_size,
+                                            collate_fn=partial(collate_batch, max_word_num=self.max_word_num, dynamic_padding=self.dynamic_padding))
         else:         
             self.myData = FTDataSetV1(self.data_files[0],
                                       self.tokenizer,
@@ -171,23 +247,33 @@ class FTLoaderV1(IDataLoader):
                                       self.entity_tag_vocab,
                                       self.external_entities,
                                       self.max_label_num,
-                                      self.word_label_embedding,
-                                      self.word_label_embedding_dim,
+                                      self.label_pair_ids,
                                       do_shuffle=self.do_shuffle,
-                                      cache=self.cache)
-
-            self.dataiter = DataLoader(self.myData, batch_size=batch_size)
+                                      cache=self.dataset_cache(self.data_files[0]),
+                                      num_processes=self.num_processes)
+
+            collate_fn = partial(collate_batch, max_word_num=self.max_word_num, dynamic_padding=self.dynamic_padding)
+            if self.bucket_batches:
+                batch_sampler = BucketBatchSampler(self.myData.get_lengths(), batch_size, self.max_tokens, seed=self.seed)
+            else:
+                batch_sampler = BatchSampler(SequentialSampler(self.myData), batch_size, drop_last=False)
+            train_set = self.myData
+            if self.prefetch_depth > 0:
+                train_set = PrefetchDataset(self.myData, self.prefetch_depth, self.prefetch_threads)
+                batch_sampler = PrefetchSampler(batch_sampler, train_set)
+            self.dataiter = DataLoader(train_set, batch_sampler=batch_sampler, collate_fn=collate_fn)
             if self.output_eval:
                 self.myData_eval =  FTDataSetV1(
                     self.data_files[1], self.tokenizer, self.lexicon_tree,
                     self.word_vocab, self.tag_vocab, self.max_word_num,
                     self.max_seq_length, self.default_tag,
                     self.entity_tag_vocab, self.external_entities,
-                    self.max_label_num, self.word_label_embedding,
-                    self.word_label_embedding_dim,
-                    cache=self.cache)
+                    self.max_label_num, self.label_pair_ids,
+                    cache=self.dataset_cache(self.data_files[1]),
+                    num_processes=self.num_processes)
                 self.dataiter_eval = DataLoader(self.myData_eval,
-                                                batch_size=eval_batch_size)
+                                                batch_size=eval_batch_size,
+                                                collate_fn=partial(collate_batch, max_word_num=self.max_word_num, dynamic_padding=self.dynamic_padding))
 
     def __call__(self):
         if self.use_test:
@@ -195,7 +281,7 @@ class FTLoaderV1(IDataLoader):
                 'test_set': self.myData_test,
                 'test_iter': self.dataiter_test,
                 'vocab_embedding': self.vocab_embedding,
-                'label_embedding': self.word_label_embedding,
+                'label_embedding': self.label_pair_embedding,
                 'embedding_dim': self.embedding_dim,
                 'label_embedding_dim': self.word_label_embedding_dim,
                 'word_vocab': self.word_vocab,
@@ -208,7 +294,7 @@ class FTLoaderV1(IDataLoader):
                 'eval_set': self.myData_eval,
                 'eval_iter': self.dataiter_eval,
                 'vocab_embedding': self.vocab_embedding,
-                'label_embedding': self.word_label_embedding,
+                'label_embedding': self.label_pair_embedding,
                 'embedding_dim': self.embedding_dim,
                 'label_embedding_dim': self.word_label_embedding_dim,
                 'word_vocab': self.word_vocab,
@@ -219,7 +305,7 @@ class FTLoaderV1(IDataLoader):
                 'train_set': self.myData,
                 'train_iter': self.dataiter,
                 'vocab_embedding': self.vocab_embedding,
-                'label_embedding': self.word_label_embedding,
+                'label_embedding': self.label_pair_embedding,
                 'embedding_dim': self.embedding_dim,
                 'label_embedding_dim': self.word_label_embedding_dim,
                 'word_vocab': self.word_vocab,
@@ -227,6 +313,11 @@ class FTLoaderV1(IDataLoader):
             }
 
 
+def _encode_label_sentence(tokenizer, sentence: Tuple[Any, str]) -> Dict[str, List[int]]:
+    text, prompt = sentence
+    return dict(tokenizer.encode_plus(text if isinstance(text, str) else list(text), prompt))
+
+
 class FTDataSetV1(Dataset):
     def __init__(
         self,
@@ -241,15 +332,16 @@ class FTDataSetV1(Dataset):
         entity_tag_vocab,
         external_entities,
         max_label_num: int,
-        word_label_embedding,
-        word_label_embedding_dim: int = 768,
+        label_pair_ids: Dict[Tuple[int, int], int],
         do_predict: bool = False,
         do_shuffle: bool = False,
         cache:FileCache = None,
+        num_processes: int = 1,
     ) -> None:
 
         self.file: str = file
         self.tokenizer = tokenizer
+        self.char_ids = CharIdTable.from_tokenizer(tokenizer)
         self.lexicon_tree: Trie = lexicon_tree
         self.word_vocab: Vocab = word_vocab
         self.label_vocab: Vocab = tag_vocab
@@ -261,9 +353,9 @@ class FTDataSetV1(Dataset):
         self.do_predict: bool = do_predict
         self.external_entities = external_entities
         self.max_label_num = max_label_num
-        self.word_label_embedding = word_label_embedding
-        self.word_label_embedding_dim = word_label_embedding_dim
+        self.label_pair_ids: Dict[Tuple[int, int], int] = label_pair_ids
         self.cache = cache
+        self.num_processes = num_processes
         if not self.do_predict:
             self.init_dataset()
 
@@ -281,8 +373,8 @@ class FTDataSetV1(Dataset):
             label = [self.default_tag] + \
                 obj["label"][:self.max_seq_length-2]+[self.default_tag]
         # convert to embedding
-        token_ids = self.tokenizer.convert_tokens_to_ids(text)
-        label_ids = self.label_vocab.token2id(label)
+        token_ids = self.char_ids.convert_tokens_to_ids(text)
+        label_ids = self.label_vocab.tokens2ids(label)
 
         labels = torch.zeros(self.max_seq_length, dtype=torch.int)
         labels[:len(label_ids)] = tensor(label_ids[:self.max_seq_length]).int()
@@ -293,165 +385,91 @@ class FTDataSetV1(Dataset):
         segment_ids[:len(token_ids)] = 0
         attention_mask = torch.zeros(self.max_seq_length, dtype=torch.int)
         attention_mask[:len(token_ids)] = 1
-        matched_word_ids = torch.zeros((self.max_seq_length, self.max_word_num),
-                                    dtype=torch.int)
-        matched_word_mask = torch.zeros((self.max_seq_length, self.max_word_num),
-                                     dtype=torch.int)
-        matched_label_ids = torch.zeros(
-            (self.max_seq_length, self.max_word_num, self.max_label_num),
-            dtype=torch.int)
-        matched_label_embeddings = torch.zeros(
-            (self.max_seq_length, self.max_word_num, self.max_label_num,
-             self.word_label_embedding_dim),
-            dtype=torch.float)
-        matched_label_mask = torch.zeros(
-            (self.max_seq_length, self.max_word_num, self.max_label_num),dtype=torch.float)
-        # get matched word
-        matched_words = self.lexicon_tree.getAllMatchedWordList(
+        # get matched word, kept sparse as (position, slot, word_id) rows with the labels of each row,
+        # densified per batch by collate_batch
+        lattice = self.lexicon_tree.getAllMatchedLattice(
             text, self.max_word_num)
-        for i, words in enumerate(matched_words):
-            word_ids = self.word_vocab.token2id(words)
-            matched_word_ids[i][:len(word_ids)] = tensor(word_ids).int()
-            matched_word_mask[i][:len(word_ids)] = 1
-            ids = []
-            masks = [0] * self.max_label_num
-            for word_index, word in enumerate(words):
-                key = str(list(word))
-                word_id = self.word_vocab.token2id(word)
-                if key in self.external_entities["entities"]:
-                    tags = list(self.external_entities["entities"][key]
-                                ["labels"].keys())[:self.max_label_num]
-                    tags = self.entity_tag_vocab.token2id(tags)
-                    masks[:len(tags)] = [1] * len(tags)
-                    matched_label_embeddings[i][word_index][:len(tags)] = tensor([
-                        self.word_label_embedding[word_id][tag] for tag in tags
-                    ]).float()
-                    if len(tags) < self.max_label_num:
-                        tags += [
-                            self.entity_tag_vocab.token2id(self.default_tag)
-                        ] * (self.max_label_num - len(tags))
-                    ids.append(tags)
-                else:
-                    ids.append(
-                        [self.entity_tag_vocab.token2id(self.default_tag)] *
-                        self.max_label_num)
-            if len(words) > 0:
-                matched_label_ids[i][:len(ids)] = tensor(ids).int()
-                matched_label_mask[i][:len(masks)] = tensor(masks).int()
+        matched_word_lattice = lattice[:, [0, 1, 4]].astype(np.int32)
+        default_label_id = self.entity_tag_vocab.token2id(self.default_tag)
+        matched_label_lattice_ids = np.full((len(lattice), self.max_label_num), default_label_id, dtype=np.int32)
+        matched_label_lattice_mask = np.zeros((len(lattice), self.max_label_num), dtype=np.float32)
+        # ids of the (word_id, tag) rows of the label embedding table, 0 is the zero vector
+        matched_label_lattice_pairs = np.zeros((len(lattice), self.max_label_num), dtype=np.int32)
+        for row, (i, word_index, start, end, word_id) in enumerate(lattice.tolist()):
+            # matched words are made of single characters, same key as str(list(word))
+            key = str(text[start:end])
+            if key in self.external_entities["entities"]:
+                tags = list(self.external_entities["entities"][key]
+                            ["labels"].keys())[:self.max_label_num]
+                tags = self.entity_tag_vocab.token2id(tags)
+                matched_label_lattice_mask[row, :len(tags)] = 1
+                matched_label_lattice_pairs[row, :len(tags)] = [self.label_pair_ids.get((word_id, tag), 0) for tag in tags]
+                matched_label_lattice_ids[row, :len(tags)] = tags
 
         if return_dict:
             return {
                 "input_ids": input_token_ids,
                 "token_type_ids": segment_ids,
                 "attention_mask": attention_mask,
-                "matched_word_ids": matched_word_ids,
-                "matched_word_mask": matched_word_mask,
-                "matched_label_ids": matched_label_ids,
-                "matched_label_mask": matched_label_mask,
-                "matched_label_embeddings": matched_label_embeddings,
+                "matched_word_lattice": matched_word_lattice,
+                "matched_label_lattice_ids": matched_label_lattice_ids,
+                "matched_label_lattice_mask": matched_label_lattice_mask,
+                "matched_label_lattice_pairs": matched_label_lattice_pairs,
                 "labels": labels,
             }
 
-        return input_token_ids, segment_ids, attention_mask, matched_word_ids, matched_word_mask, matched_label_ids, matched_label_mask, matched_label_embeddings, labels
+        return input_token_ids, segment_ids, attention_mask, matched_word_lattice, matched_label_lattice_ids, matched_label_lattice_mask, matched_label_lattice_pairs, labels
+
+    def convert_line(self, line):
+        data: Dict[str, List[Any]] = json.loads(line.strip())
+        input_token_ids, segment_ids, attention_mask, matched_word_lattice, matched_label_lattice_ids, matched_label_lattice_mask, matched_label_lattice_pairs, labels = self.convert_embedding(
+            data)
+        return [input_token_ids.numpy(), segment_ids.numpy(), attention_mask.numpy(), matched_word_lattice,
+                matched_label_lattice_ids, matched_label_lattice_mask, matched_label_lattice_pairs, labels.numpy()]
 
     def init_dataset(self):
         reader = FileReader(self.file)
         line_total = reader.line_size()
-        self.input_token_ids = []
-        self.segment_ids = []
-        self.attention_mask = []
-        self.matched_word_ids = []
-        self.matched_word_mask = []
-        self.matched_label_ids = []
-        self.matched_label_mask = []
-        # self.matched_label_embeddings = []
-        self.matched_label_embeddings_path = tempfile.mkdtemp()
-        self.labels = []
-        cache = self.cache.group("temp_embedding")
-
-        for index, line in tqdm(enumerate(reader.line_iter()),
-                                desc=f"load dataset from {self.file}",
-                                total=line_total):
-            line = line.strip()
-            data: Dict[str, List[Any]] = json.loads(line)
-            input_token_ids, segment_ids, attention_mask, matched_word_ids, matched_word_mask, matched_label_ids, matched_label_mask, matched_label_embeddings, labels = self.convert_embedding(
-                data)
-
-            self.input_token_ids.append(input_token_ids)
-            self.segment_ids.append(segment_ids)
-            self.attention_mask.append(attention_mask)
-            self.matched_word_ids.append(matched_word_ids)
-            self.matched_word_mask.append(matched_word_mask)
-            self.matched_label_ids.append(matched_label_ids)
-            self.matched_label_mask.append(matched_label_mask)
-            cache.save(f"{index}.pkl",matched_label_embeddings)
-            self.labels.append(labels)
+        names = ["input_token_ids", "segment_ids", "attention_mask", "matched_word_lattice",
+                 "matched_label_lattice_ids", "matched_label_lattice_mask", "matched_label_lattice_pairs", "labels"]
+        ragged = ["matched_word_lattice", "matched_label_lattice_ids", "matched_label_lattice_mask", "matched_label_lattice_pairs"]
+
+        def rows():
+            return tqdm(map_ordered(self.convert_line, reader.line_iter(), self.num_processes),
+                        desc=f"load dataset from {self.file}",
+                        total=line_total)
+
+        fields = DatasetStore.load_or_build(self.cache.group("tensors").root, names, rows, line_total, ragged)
+        for name in names:
+            setattr(self, name, fields[name] if name in ragged else torch.from_numpy(fields[name]))
 
         self.size = len(self.input_token_ids)
         self.indexes = [i for i in range(self.size)]
-        self.preload_thread:threading.Thread = threading.Thread(target=FTDataSetV1.__preloadding,args=(self,slice(0,1000,1)))
-        self.preload_thread.start()
         if self.do_shuffle:
             random.shuffle(self.indexes)
 
-    def __del__(self):
-        if self.preload_thread.isAlive():
-            self.preload_thread.join()
-
-    def __preloadding(self,idx:Union[slice,int]):
-        idx = self.indexes[idx]
-        if isinstance(idx,list):
-            for i in idx:
-                self.__get_matched_label_embeddings(i)
-        else:
-            self.__get_matched_label_embeddings(idx)
-
-    @lru_cache(2000)
-    def __get_matched_label_embeddings(self,index):
-        cache = self.cache.group("temp_embedding")
-        return cache.load(f"{index}.pkl")
+    def __get_sample(self, idx):
+        return {
+            'input_ids': self.input_token_ids[idx],
+            'attention_mask': self.attention_mask[idx],
+            'token_type_ids': self.segment_ids[idx],
+            'matched_word_lattice': np.asarray(self.matched_word_lattice[idx]),
+            'matched_label_lattice_ids': np.asarray(self.matched_label_lattice_ids[idx]),
+            'matched_label_lattice_mask': np.asarray(self.matched_label_lattice_mask[idx]),
+            'matched_label_lattice_pairs': np.asarray(self.matched_label_lattice_pairs[idx]),
+            'labels': self.labels[idx]
+        }
 
     def __getitem__(self, index):
         idx = self.indexes[index]
-        matched_label_embeddings = []
         if isinstance(idx, list):
-            for i in idx:
-                matched_label_embeddings.append(self.__get_matched_label_embeddings(i))
-            matched_label_embeddings = torch.stack(matched_label_embeddings)
-            
-            if not self.preload_thread.isAlive():
-                self.preload_thread:threading.Thread = threading.Thread(target=FTDataSetV1.__preloadding,args=(self,slice(index.stop,index.stop+1000,1)))
-                self.preload_thread.start()
-
-            return {
-                'input_ids': torch.stack([self.input_token_ids[i] for i in idx]),
-                'attention_mask': torch.stack([self.attention_mask[i] for i in idx]),
-                'token_type_ids': torch.stack([self.segment_ids[i] for i in idx]),
-                'matched_word_ids': torch.stack([self.matched_word_ids[i] for i in idx]),
-                'matched_word_mask': torch.stack([self.matched_word_mask[i] for i in idx]),
-                'matched_label_ids': torch.stack([self.matched_label_ids[i] for i in idx]),
-                'matched_label_mask': torch.stack([self.matched_label_mask[i] for i in idx]),
-                'matched_label_embeddings': matched_label_embeddings,
-                'labels': torch.stack([self.labels[i] for i in idx])
-            }
+            return collate_batch([self.__get_sample(i) for i in idx], max_word_num=self.max_word_num)
         else:
-            matched_label_embeddings = self.__get_matched_label_embeddings(idx)
-
-            if not self.preload_thread.isAlive():
-                self.preload_thread:threading.Thread = threading.Thread(target=FTDataSetV1.__preloadding,args=(self,slice(index+1,index+1001,1)))
-                self.preload_thread.start()
+            return self.__get_sample(idx)
 
-            return {
-                'input_ids': self.input_token_ids[idx],
-                'attention_mask': self.attention_mask[idx],
-                'token_type_ids': self.segment_ids[idx],
-                'matched_word_ids': self.matched_word_ids[idx],
-                'matched_word_mask': self.matched_word_mask[idx],
-                'matched_label_ids': self.matched_label_ids[idx],
-                'matched_label_mask': self.matched_label_mask[idx],
-                'matched_label_embeddings': matched_label_embeddings,
-                'labels': self.labels[idx]
-            }
+    def get_lengths(self) -> np.ndarray:
+        # sample lengths in the order of __getitem__
+        return self.attention_mask[self.indexes].sum(dim=1).numpy()
 
     def __len__(self):
         return self.size
@@ -8,6 +8,7 @@ from ICCSupervised.ICCSupervised import IDataLoader
 import json
 import numpy as np
 import random
+from functools import partial
 
 
 class LabelLLoader(IDataLoader):
@@ -17,6 +18,8 @@ class LabelLLoader(IDataLoader):
             .add_argument("eval_batch_size", int, defaultValue=16) \
             .add_argument("test_batch_size", int, defaultValue=16) \
             .add_argument("word_embedding_file", str) \
+            .add_argument("word_embedding_store", str, optional=True) \
+            .add_argument("embedding_dtype", str, defaultValue="float32") \
             .add_argument("tag_embedding_file",str) \
             .add_argument("word_vocab_file_with_tag",str) \
             .add_argument("word_vocab_file", str) \
@@ -27,6 +30,11 @@ class LabelLLoader(IDataLoader):
             .add_argument("bert_vocab_file", str) \
             .add_argument("output_eval", bool, defaultValue=True) \
             .add_argument("max_scan_num", int, defaultValue=1000000) \
+            .add_argument("use_double_array_trie", bool, defaultValue=False) \
+            .add_argument("num_processes", int, defaultValue=1) \
+            .add_argument("cache_max_size", int, optional=True, description="maximum bytes of ./temp/artifacts") \
+            .add_argument("shared_cache_dir", str, optional=True, description="shared memory tier, e.g. /dev/shm/cc_artifacts") \
+            .add_argument("cache_fingerprint", str, defaultValue="etag", description="etag: md5 of the data files, hashed once per version, fast: size, mtime, inode and sampled blocks") \
             .add_argument("add_seq_vocab", bool, defaultValue=False) \
             .add_argument("max_seq_length", int, defaultValue=256) \
             .add_argument("max_word_num", int, defaultValue=5) \
@@ -34,15 +42,15 @@ class LabelLLoader(IDataLoader):
             .add_argument("use_test", bool, defaultValue=False) \
             .add_argument("do_shuffle", bool, defaultValue=False) \
             .add_argument("do_predict", bool, defaultValue=False) \
+            .add_argument("dynamic_padding", bool, defaultValue=False, description="trim batches to their longest sequence") \
+            .add_argument("bucket_batches", bool, defaultValue=False, description="batch training samples of similar length") \
+            .add_argument("max_tokens", int, optional=True, description="padded tokens per bucketed batch instead of batch_size") \
+            .add_argument("seed", int, defaultValue=0) \
             .add_argument("task_name", str) \
             .add_argument("ignore_rules",list,optional=True) \
             .parse(self, **args)
 
-        # get cache_key
-        files = [self.train_file,self.eval_file,self.test_file,self.tag_file] 
-        self.cache_key = [FileReader(file).etag() if file is not None else "None" for file in files]
-        self.cache_key = "_".join(self.cache_key)
-        self.cache = FileCache(f"./temp/{self.cache_key}")
+        self.cache = ArtifactCache(max_size=self.cache_max_size, shared_dir=self.shared_cache_dir, fingerprint=self.cache_fingerprint)
 
         self.read_data_set()
         self.verify_data()
@@ -54,34 +62,46 @@ class LabelLLoader(IDataLoader):
             self.train_file, self.eval_file, self.test_file]
               
         # build lexicon tree
-        cache = self.cache.group(self.max_scan_num)
+        cache = self.cache
 
-        self.lexicon_tree = cache.load("lexicon_tree",lambda: TrieFactory.get_trie_from_vocabs(
-                [self.word_vocab_file], self.max_scan_num))
+        if self.use_double_array_trie:
+            self.lexicon_tree = TrieFactory.get_double_array_trie_from_vocabs(
+                [self.word_vocab_file], self.max_scan_num, cache.group(
+                    "lexicon_tree", paths=[self.word_vocab_file],
+                    params={"max_scan_num": self.max_scan_num, "double_array": True}).root)
+        else:
+            self.lexicon_tree = cache.load("lexicon_tree",lambda: TrieFactory.get_trie_from_vocabs(
+                    [self.word_vocab_file], self.max_scan_num),
+                paths=[self.word_vocab_file], params={"max_scan_num": self.max_scan_num})
 
         self.matched_words = cache.load("matched_words",lambda: TrieFactory.get_all_matched_word_from_dataset(
-            self.data_files, self.lexicon_tree))
+            self.data_files, self.lexicon_tree, self.num_processes),
+            files=self.data_files, deps=["lexicon_tree"])
 
         # restore all word_vocab_file_with_tag
         self.word_vocab = cache.load("word_vocab_tag",lambda: VocabTag().from_files(
-            [self.word_vocab_file_with_tag], is_word=True, has_default=False, unk_num=5, max_scan_num=self.max_scan_num))
+            [self.word_vocab_file_with_tag], is_word=True, has_default=False, unk_num=5, max_scan_num=self.max_scan_num),
+            paths=[self.word_vocab_file_with_tag], params={"max_scan_num": self.max_scan_num})
 
         matched_words_with_tags = [(word, self.word_vocab.tag(word))
                                    for word in self.matched_words]
         # re assign word_vocab for matched_words
         self.word_vocab = VocabTag().from_list(matched_words_with_tags,
                                                is_word=True, has_default=False, unk_num=5)
+        self.lexicon_tree.set_word_ids(self.word_vocab)
 
         self.tag_vocab: Vocab = Vocab().from_files(
             [self.tag_file], is_word=False)
 
         self.entity_tag_vocab:Vocab = Vocab().from_files([self.tag_embedding_file],is_word=False,skip=1)
 
-        self.vocab_embedding,self.embedding_dim = cache.load("vocab_embedding",lambda: VocabEmbedding(self.word_vocab).build_from_file(
-            self.word_embedding_file, self.max_scan_num, self.add_seq_vocab).get_embedding())
+        self.vocab_embedding,self.embedding_dim = cache.load("vocab_embedding",lambda: VocabEmbedding(self.word_vocab, self.embedding_dtype).build_from_file(
+            self.word_embedding_file, self.max_scan_num, self.add_seq_vocab, self.word_embedding_store, self.num_processes).get_embedding(),
+            paths=[self.word_embedding_file], params={"max_scan_num": self.max_scan_num, "add_seq_vocab": self.add_seq_vocab, "embedding_dtype": self.embedding_dtype}, deps=["matched_words", "word_vocab_tag"])
 
-        self.entity_tag_embedding,self.entity_tag_embedding_dim = cache.load("tag_vocab_embedding",lambda: VocabEmbedding(self.entity_tag_vocab).build_from_file(
-            self.tag_embedding_file, self.max_scan_num, self.add_seq_vocab).get_embedding())
+        self.entity_tag_embedding,self.entity_tag_embedding_dim = cache.load("tag_vocab_embedding",lambda: VocabEmbedding(self.entity_tag_vocab, self.embedding_dtype).build_from_file(
+            self.tag_embedding_file, self.max_scan_num, self.add_seq_vocab).get_embedding(),
+            paths=[self.tag_embedding_file], params={"max_scan_num": self.max_scan_num, "add_seq_vocab": self.add_seq_vocab, "embedding_dtype": self.embedding_dtype})
 
         self.tokenizer = BertTokenizer.from_pretrained(self.bert_vocab_file)
 
@@ -91,20 +111,25 @@ class LabelLLoader(IDataLoader):
     def process_data(self, batch_size: int, eval_batch_size: int = None, test_batch_size: int = None):
         if self.use_test:
             self.myData_test = LEBertDataSet(self.data_files[2], self.tokenizer, self.lexicon_tree,
-                                            self.word_vocab, self.tag_vocab, self.max_word_num, self.max_seq_length, self.default_tag,self.entity_tag_vocab,self.do_predict,ignore_rules=self.ignore_rules)
+                                            self.word_vocab, self.tag_vocab, self.max_word_num, self.max_seq_length, self.default_tag,self.entity_tag_vocab,self.do_predict,ignore_rules=self.ignore_rules, num_processes=self.num_processes)
             self.dataiter_test = DataLoader(
-                self.myData_test, batch_size=test_batch_size)
+                self.myData_test, batch_size=test_batch_size, collate_fn=partial(collate_batch, max_word_num=self.max_word_num, dynamic_padding=self.dynamic_padding))
         else:
             self.myData = LEBertDataSet(self.data_files[0], self.tokenizer, self.lexicon_tree, self.word_vocab,
-                                        self.tag_vocab, self.max_word_num, self.max_seq_length, self.default_tag,self.entity_tag_vocab, do_shuffle=self.do_shuffle,ignore_rules=self.ignore_rules)
+                                        self.tag_vocab, self.max_word_num, self.max_seq_length, self.default_tag,self.entity_tag_vocab, do_shuffle=self.do_shuffle,ignore_rules=self.ignore_rules, num_processes=self.num_processes)
 
-            self.dataiter = DataLoader(self.myData, batch_size=batch_size)
+            collate_fn = partial(collate_batch, max_word_num=self.max_word_num, dynamic_padding=self.dynamic_padding)
+            if self.bucket_batches:
+                self.dataiter = DataLoader(self.myData, batch_sampler=BucketBatchSampler(
+                    self.myData.get_lengths(), batch_size, self.max_tokens, seed=self.seed), collate_fn=collate_fn)
+            else:
+                self.dataiter = DataLoader(self.myData, batch_size=batch_size, collate_fn=collate_fn)
             if self.output_eval:
                 key = "eval_data"
                 self.myData_eval = LEBertDataSet(self.data_files[1], self.tokenizer, self.lexicon_tree, self.word_vocab,
-                                                 self.tag_vocab, self.max_word_num,  self.max_seq_length, self.default_tag,self.entity_tag_vocab,ignore_rules=self.ignore_rules)
+                                                 self.tag_vocab, self.max_word_num,  self.max_seq_length, self.default_tag,self.entity_tag_vocab,ignore_rules=self.ignore_rules, num_processes=self.num_processes)
                 self.dataiter_eval = DataLoader(
-                        self.myData_eval, batch_size=eval_batch_size)
+                        self.myData_eval, batch_size=eval_batch_size, collate_fn=partial(collate_batch, max_word_num=self.max_word_num, dynamic_padding=self.dynamic_padding))
 
     def __call__(self):
         if self.use_test:
@@ -145,9 +170,10 @@ class LabelLLoader(IDataLoader):
 
 
 class LEBertDataSet(Dataset):
-    def __init__(self, file: str, tokenizer, lexicon_tree: Trie, word_vocab: Vocab, tag_vocab: Vocab, max_word_num: int, max_seq_length: int, default_tag: str, entity_tag_vocab, do_predict: bool = False, do_shuffle: bool = False,ignore_rules = None):
+    def __init__(self, file: str, tokenizer, lexicon_tree: Trie, word_vocab: Vocab, tag_vocab: Vocab, max_word_num: int, max_seq_length: int, default_tag: str, entity_tag_vocab, do_predict: bool = False, do_shuffle: bool = False,ignore_rules = None, num_processes: int = 1):
         self.file: str = file
         self.tokenizer = tokenizer
+        self.char_ids = CharIdTable.from_tokenizer(tokenizer)
         self.lexicon_tree: Trie = lexicon_tree
         self.word_vocab: Vocab = word_vocab
         self.label_vocab: Vocab = tag_vocab
@@ -157,6 +183,7 @@ class LEBertDataSet(Dataset):
         self.default_tag: str = default_tag
         self.do_shuffle: bool = do_shuffle
         self.do_predict: bool = do_predict
+        self.num_processes: int = num_processes
         self.ignore_rules = ignore_rules
         if not self.do_predict:
             self.init_dataset()
@@ -173,93 +200,67 @@ class LEBertDataSet(Dataset):
             label = [self.default_tag] + \
                 obj["label"][:self.max_seq_length-2]+[self.default_tag]
         # convert to embedding
-        token_ids = self.tokenizer.convert_tokens_to_ids(text)
-        label_ids = self.label_vocab.token2id(label)
+        token_ids = self.char_ids.convert_tokens_to_ids(text)
+        label_ids = self.label_vocab.tokens2ids(label)
 
-        labels = np.zeros(self.max_seq_length, dtype=np.int)
+        labels = np.zeros(self.max_seq_length, dtype=np.int16)
         labels[:len(label_ids)] = label_ids[:self.max_seq_length]
         # init input
-        input_token_ids = np.zeros(self.max_seq_length, dtype=np.int)
+        input_token_ids = np.zeros(self.max_seq_length, dtype=np.int32)
         input_token_ids[:len(token_ids)] = token_ids[:self.max_seq_length]
-        segment_ids = np.ones(self.max_seq_length, dtype=np.int)
+        segment_ids = np.ones(self.max_seq_length, dtype=np.uint8)
         segment_ids[:len(token_ids)] = 0
-        attention_mask = np.zeros(self.max_seq_length, dtype=np.int)
+        attention_mask = np.zeros(self.max_seq_length, dtype=np.uint8)
         attention_mask[:len(token_ids)] = 1
-        matched_word_ids = np.zeros(
-            (self.max_seq_length, self.max_word_num), dtype=np.int)
-        matched_word_mask = np.zeros(
-            (self.max_seq_length, self.max_word_num), dtype=np.int)
-        matched_label_ids = np.zeros((self.max_seq_length,self.max_word_num),dtype=np.int)
-        # get matched word
-        matched_words = self.lexicon_tree.getAllMatchedWordList(
+        # get matched word, kept sparse as (position, slot, word_id) rows with the entity tag of each row,
+        # densified per batch by collate_batch
+        lattice = self.lexicon_tree.getAllMatchedLattice(
             text, self.max_word_num)
-        for i, words in enumerate(matched_words):
-            word_ids = self.word_vocab.token2id(words)
-            matched_word_ids[i][:len(word_ids)] = word_ids
-            matched_word_mask[i][:len(word_ids)] = 1
-            ids = []
-            for word in words:
-                tag = self.word_vocab.tag(word)[0]
-                if tag != self.default_tag:
-                    tag = "-".join(tag.split("-")[1:])
-                if self.ignore_rules is not None and tag in self.ignore_rules:
-                    tag = self.default_tag
-                ids.append(self.entity_tag_vocab.token2id(tag))
-            
-            matched_label_ids[i][:len(ids)] = ids
+        matched_word_lattice = lattice[:, [0, 1, 4]].astype(np.int32)
+        matched_label_lattice_ids = np.zeros(len(lattice), dtype=np.int16)
+        for row, (i, slot, _, _, word_id) in enumerate(lattice.tolist()):
+            # an unknown word has the same tag as its unk token
+            tag = self.word_vocab.tag(self.word_vocab.id2token(word_id))[0]
+            if tag != self.default_tag:
+                tag = "-".join(tag.split("-")[1:])
+            if self.ignore_rules is not None and tag in self.ignore_rules:
+                tag = self.default_tag
+            matched_label_lattice_ids[row] = self.entity_tag_vocab.token2id(tag)
 
         if to_tensor:
             input_token_ids = tensor(input_token_ids)
             segment_ids = tensor(segment_ids)
             attention_mask = tensor(segment_ids)
-            matched_word_ids = tensor(matched_word_ids)
-            matched_word_mask = tensor(matched_word_mask)
+            matched_word_lattice = tensor(matched_word_lattice)
             labels = tensor(labels)
         if return_dict:
             return {
                 "input_ids": input_token_ids,
                 "token_type_ids": segment_ids,
                 "attention_mask": attention_mask,
-                "matched_word_ids": matched_word_ids,
-                "matched_word_mask": matched_word_mask,
-                "matched_label_ids": matched_label_ids,
+                "matched_word_lattice": matched_word_lattice,
+                "matched_label_lattice_ids": matched_label_lattice_ids,
                 "labels": labels,
             }
 
-        return input_token_ids, segment_ids, attention_mask, matched_word_ids, matched_word_mask,matched_label_ids, labels
+        return input_token_ids, segment_ids, attention_mask, matched_word_lattice, matched_label_lattice_ids, labels
 
-    def init_dataset(self):
-        line_total = FileUtil.count_lines(self.file)
-        self.input_token_ids = []
-        self.segment_ids = []
-        self.attention_mask = []
-        self.matched_word_ids = []
-        self.matched_word_mask = []
-        self.matched_label_ids = []
-        self.labels = []
+    def convert_line(self, line: str):
+        data: Dict[str, List[Any]] = json.loads(line.strip())
+        return self.convert_embedding(data)
 
-        for line in tqdm(FileUtil.line_iter(self.file), desc=f"load dataset from {self.file}", total=line_total):
-            line = line.strip()
-            data: Dict[str, List[Any]] = json.loads(line)
-            input_token_ids, segment_ids, attention_mask, matched_word_ids, matched_word_mask,matched_label_ids, labels = self.convert_embedding(
-                data)
+    def init_dataset(self):
+        line_total = FileReader(self.file).line_size()
+        names = ["input_token_ids", "segment_ids", "attention_mask", "matched_word_lattice", "matched_label_lattice_ids", "labels"]
 
-            self.input_token_ids.append(input_token_ids)
-            self.segment_ids.append(segment_ids)
-            self.attention_mask.append(attention_mask)
-            self.matched_word_ids.append(matched_word_ids)
-            self.matched_word_mask.append(matched_word_mask)
-            self.matched_label_ids.append(matched_label_ids)
-            self.labels.append(labels)
+        def rows():
+            return tqdm(map_ordered(self.convert_line, FileUtil.line_iter(self.file), self.num_processes),
+                        desc=f"load dataset from {self.file}", total=line_total)
 
+        fields = DatasetStore.load_or_build(None, names, rows, line_total, ragged=["matched_word_lattice", "matched_label_lattice_ids"])
+        for name in names:
+            setattr(self, name, fields[name])
         self.size = len(self.input_token_ids)
-        self.input_token_ids = np.array(self.input_token_ids)
-        self.segment_ids = np.array(self.segment_ids)
-        self.attention_mask = np.array(self.attention_mask)
-        self.matched_word_ids = np.array(self.matched_word_ids)
-        self.matched_word_mask = np.array(self.matched_word_mask)
-        self.matched_label_ids = np.array(self.matched_label_ids)
-        self.labels = np.array(self.labels)
         self.indexes = [i for i in range(self.size)]
         if self.do_shuffle:
             random.shuffle(self.indexes)
@@ -270,11 +271,14 @@ class LEBertDataSet(Dataset):
             'input_ids': tensor(self.input_token_ids[idx]),
             'attention_mask': tensor(self.attention_mask[idx]),
             'token_type_ids': tensor(self.segment_ids[idx]),
-            'matched_word_ids': tensor(self.matched_word_ids[idx]),
-            'matched_word_mask': tensor(self.matched_word_mask[idx]),
-            'matched_label_ids': tensor(self.matched_label_ids[idx]),
+            'matched_word_lattice': np.asarray(self.matched_word_lattice[idx]),
+            'matched_label_lattice_ids': np.asarray(self.matched_label_lattice_ids[idx]),
             'labels': tensor(self.labels[idx])
         }
 
+    def get_lengths(self) -> np.ndarray:
+        # sample lengths in the order of __getitem__
+        return np.asarray(self.attention_mask)[self.indexes].sum(axis=1)
+
     def __len__(self):
         return self.size
@@ -18,6 +18,8 @@ class LXLoader(IDataLoader):
             .add_argument("eval_batch_size", int, defaultValue=16) \
             .add_argument("test_batch_size", int, defaultValue=16) \
             .add_argument("word_embedding_file", str) \
+            .add_argument("word_embedding_store", str, optional=True) \
+            .add_argument("embedding_dtype", str, defaultValue="float32") \
             .add_argument("word_vocab_file", str) \
             .add_argument("word_vocab_file_with_tag", str) \
             .add_argument("train_file", str) \
@@ -27,6 +29,11 @@ class LXLoader(IDataLoader):
             .add_argument("bert_vocab_file", str) \
             .add_argument("output_eval", bool, defaultValue=True) \
             .add_argument("max_scan_num", int, defaultValue=1000000) \
+            .add_argument("use_double_array_trie", bool, defaultValue=False) \
+            .add_argument("num_processes", int, defaultValue=1) \
+            .add_argument("cache_max_size", int, optional=True, description="maximum bytes of ./temp/artifacts") \
+            .add_argument("shared_cache_dir", str, optional=True, description="shared memory tier, e.g. /dev/shm/cc_artifacts") \
+            .add_argument("cache_fingerprint", str, defaultValue="etag", description="etag: md5 of the data files, hashed once per version, fast: size, mtime, inode and sampled blocks") \
             .add_argument("add_seq_vocab", bool, defaultValue=False) \
             .add_argument("max_seq_length", int, defaultValue=256) \
             .add_argument("max_word_num", int, defaultValue=5) \
@@ -41,12 +48,12 @@ class LXLoader(IDataLoader):
             .add_argument("debug", bool, defaultValue=False) \
             .add_argument("pass_none_rule", bool, defaultValue=False) \
             .add_argument("skip_single_matched_word",bool,defaultValue=False) \
+            .add_argument("streaming", bool, defaultValue=False, description="convert training samples on the fly") \
+            .add_argument("shuffle_buffer", int, defaultValue=0) \
+            .add_argument("seed", int, defaultValue=0) \
             .parse(self, **args)
 
-        files = [self.train_file,self.eval_file,self.test_file,self.tag_file] 
-        self.cache_key = [FileReader(file).etag() if file is not None else "None" for file in files]
-        self.cache_key = "_".join(self.cache_key)
-        self.cache = FileCache(f"./temp/{self.cache_key}")
+        self.cache = ArtifactCache(max_size=self.cache_max_size, shared_dir=self.shared_cache_dir, fingerprint=self.cache_fingerprint)
 
         self.read_data_set()
         self.verify_data()
@@ -71,16 +78,25 @@ class LXLoader(IDataLoader):
 
     def read_data_set(self):
         self.data_files = [self.train_file, self.eval_file, self.test_file]
-        cache = self.cache.group(self.max_scan_num)
+        cache = self.cache
         # loading lexicon tree
-        self.lexicon_tree = cache.load("lexicon_tree",lambda: TrieFactory.get_trie_from_vocabs(
-            [self.word_vocab_file], self.max_scan_num))
+        if self.use_double_array_trie:
+            self.lexicon_tree = TrieFactory.get_double_array_trie_from_vocabs(
+                [self.word_vocab_file], self.max_scan_num, cache.group(
+                    "lexicon_tree", paths=[self.word_vocab_file],
+                    params={"max_scan_num": self.max_scan_num, "double_array": True}).root)
+        else:
+            self.lexicon_tree = cache.load("lexicon_tree",lambda: TrieFactory.get_trie_from_vocabs(
+                [self.word_vocab_file], self.max_scan_num),
+                paths=[self.word_vocab_file], params={"max_scan_num": self.max_scan_num})
 
         self.matched_words: List[str] = cache.load("matched_words",lambda: TrieFactory.get_all_matched_word_from_dataset(
-            self.data_files, self.lexicon_tree))
+            self.data_files, self.lexicon_tree, self.num_processes),
+            files=self.data_files, deps=["lexicon_tree"])
         # restore all word_vocab_file_with_tag
         self.word_vocab = cache.load("word_vocab_tag",lambda: VocabTag().from_files(
-            [self.word_vocab_file_with_tag], is_word=True, has_default=False, unk_num=5, max_scan_num=self.max_scan_num))
+            [self.word_vocab_file_with_tag], is_word=True, has_default=False, unk_num=5, max_scan_num=self.max_scan_num),
+            paths=[self.word_vocab_file_with_tag], params={"max_scan_num": self.max_scan_num})
 
         matched_words_with_tags = [(word, self.word_vocab.tag(word))
                                    for word in self.matched_words]
@@ -90,29 +106,49 @@ class LXLoader(IDataLoader):
 
         self.tag_vocab = Vocab().from_files([self.tag_file])
 
-        self.vocab_embedding, self.embedding_dim = cache.load("word_embedding",lambda: VocabEmbedding(self.word_vocab).build_from_file(
-            self.word_embedding_file, self.max_scan_num, self.add_seq_vocab).get_embedding())
+        self.vocab_embedding, self.embedding_dim = cache.load("word_embedding",lambda: VocabEmbedding(self.word_vocab, self.embedding_dtype).build_from_file(
+            self.word_embedding_file, self.max_scan_num, self.add_seq_vocab, self.word_embedding_store, self.num_processes).get_embedding(),
+            paths=[self.word_embedding_file], params={"max_scan_num": self.max_scan_num, "add_seq_vocab": self.add_seq_vocab, "embedding_dtype": self.embedding_dtype}, deps=["matched_words", "word_vocab_tag"])
 
         self.tag_convert: TagConvert = TagConvert(
             self.tag_rules, not_found_action="return" if self.pass_none_rule else "exception")
         self.tokenizer = BertTokenizer.from_pretrained(self.bert_vocab_file)
+        self.char_ids = CharIdTable.from_tokenizer(self.tokenizer)
+
+    def dataset_store(self, file: str) -> str:
+        return self.cache.group("dataset", files=[file, self.tag_file], paths=[self.bert_vocab_file],
+                                params={"max_seq_length": self.max_seq_length, "max_word_num": self.max_word_num,
+                                        "default_tag": self.default_tag, "tag_rules": self.tag_rules,
+                                        "pass_none_rule": self.pass_none_rule,
+                                        "skip_single_matched_word": self.skip_single_matched_word},
+                                deps=["matched_words", "word_vocab_tag"]).root
 
     def verify_data(self):
         pass
 
     def process_data(self):
         if self.use_test:
-            self.myData_test = LEXBertDataSet(self.data_files[2], **vars(self))
+            self.myData_test = LEXBertDataSet(
+                self.data_files[2], self.dataset_store(self.data_files[2]), **vars(self))
             self.dataiter_test = DataLoader(
-                self.myData_test, batch_size=self.test_batch_size)
+                self.myData_test, batch_size=self.test_batch_size, collate_fn=collate_batch)
         else:
-            self.myData = LEXBertDataSet(self.data_files[0], **vars(self))
-            self.dataiter = DataLoader(self.myData, batch_size=self.batch_size)
+            if self.streaming:
+                # samples are converted in the DataLoader workers, num_processes of them
+                self.myData = StreamingDataset(self.data_files[0], LEXBertDataSet(
+                    self.data_files[0], convert_only=True, **vars(self)).convert_sample,
+                    shuffle_buffer=self.shuffle_buffer, seed=self.seed)
+                self.dataiter = DataLoader(self.myData, batch_size=self.batch_size, collate_fn=collate_batch,
+                                           num_workers=self.num_processes if self.num_processes > 1 else 0)
+            else:
+                self.myData = LEXBertDataSet(
+                    self.data_files[0], self.dataset_store(self.data_files[0]), **vars(self))
+                self.dataiter = DataLoader(self.myData, batch_size=self.batch_size, collate_fn=collate_batch)
             if self.output_eval:
                 self.myData_eval = LEXBertDataSet(
-                    self.data_files[1], **vars(self))
+                    self.data_files[1], self.dataset_store(self.data_files[1]), **vars(self))
                 self.dataiter_eval = DataLoader(
-                    self.myData_eval, batch_size=self.eval_batch_size)
+                    self.myData_eval, batch_size=self.eval_batch_size, collate_fn=collate_batch)
 
     def __call__(self):
         if self.use_test:
@@ -147,11 +183,15 @@ class LXLoader(IDataLoader):
 
 
 class LEXBertDataSet(Dataset):
-    def __init__(self, dataset_file: str, **args):
+    def __init__(self, dataset_file: str, store_path: str = None, convert_only: bool = False, **args):
         self.file = dataset_file
+        # directory of the converted dataset, reused across runs
+        self.store_path = store_path
         for name in args.keys():
             setattr(self, name, args[name])
-        self.__init_dataset()
+        # convert_only: samples are converted by convert_sample, e.g. for StreamingDataset
+        if not convert_only:
+            self.__init_dataset()
 
     def convert_embedding(self, item):
         if "text" not in item:
@@ -236,9 +276,9 @@ class LEXBertDataSet(Dataset):
                     origin_text += prompt_origin
 
             # convert to ids
-            token_ids = self.tokenizer.convert_tokens_to_ids(text)
-            label_ids = self.tag_vocab.token2id(label)
-            origin_text = self.tokenizer.convert_tokens_to_ids(origin_text)
+            token_ids = self.char_ids.convert_tokens_to_ids(text)
+            label_ids = self.tag_vocab.tokens2ids(label)
+            origin_text = self.char_ids.convert_tokens_to_ids(origin_text)
 
             labels = []
             for m, token_id in zip(mask, origin_text):
@@ -247,23 +287,23 @@ class LEXBertDataSet(Dataset):
                 else:
                     labels.append(-100)
 
-            np_input_ids = np.zeros(self.max_seq_length, dtype=np.int)
+            np_input_ids = np.zeros(self.max_seq_length, dtype=np.int32)
             np_input_ids[:len(token_ids)] = token_ids
 
-            np_token_type_ids = np.ones(self.max_seq_length, dtype=np.int)
+            np_token_type_ids = np.ones(self.max_seq_length, dtype=np.uint8)
             np_token_type_ids[:text_origin_length] = 0
 
-            np_attention_mask = np.ones(self.max_seq_length, dtype=np.int)
+            np_attention_mask = np.ones(self.max_seq_length, dtype=np.uint8)
             np_attention_mask[:len(mask)] = mask
 
-            np_label_ids = np.zeros(self.max_seq_length, dtype=np.int)
+            np_label_ids = np.zeros(self.max_seq_length, dtype=np.int16)
             np_label_ids[:len(label_ids)] = label_ids
 
-            np_labels = np.zeros(self.max_seq_length, dtype=np.int)
+            np_labels = np.zeros(self.max_seq_length, dtype=np.int32)
             np_labels[:len(labels)] = labels
             np_labels[len(labels):] = -100
 
-            np_origin_labels = np.zeros(self.max_seq_length, dtype=np.int)
+            np_origin_labels = np.zeros(self.max_seq_length, dtype=np.int32)
             np_origin_labels[:len(origin_text)] = origin_text
             np_origin_labels[len(labels):] = -100
 
@@ -312,43 +352,33 @@ class LEXBertDataSet(Dataset):
 
         raise NotImplemented("do_predict not implement")
 
+    def convert_line(self, line: str):
+        data: Dict[str, List[Any]] = json.loads(line.strip())
+        return self.convert_embedding(data)
+
+    def convert_sample(self, line: str) -> Dict[str, np.ndarray]:
+        input_token_ids, token_type_ids, attention_mask, input_labels, origin_labels, labels = self.convert_line(line)
+        return {
+            'input_ids': input_token_ids,
+            'attention_mask': attention_mask,
+            'token_type_ids': token_type_ids,
+            'origin_labels': origin_labels,
+            'input_labels': input_labels,
+            'labels': labels
+        }
+
     def __init_dataset(self):
-        line_total = FileUtil.count_lines(self.file)
-        self.input_token_ids = []
-        self.token_type_ids = []
-        self.attention_mask = []
-        # self.matched_word_ids = []
-        # self.matched_word_mask = []
-        # self.matched_word_label_ids = []
-        self.origin_labels = []
-        self.input_labels = []
-        self.labels = []
-
-        for line in tqdm(FileUtil.line_iter(self.file), desc=f"load dataset from {self.file}", total=line_total):
-            line = line.strip()
-            data: Dict[str, List[Any]] = json.loads(line)
-            input_token_ids, token_type_ids, attention_mask, input_labels, origin_label, labels = self.convert_embedding(
-                data)
-            # matched_word_ids, matched_word_mask, matched_word_label_ids,
-            self.input_token_ids.append(input_token_ids)
-            self.token_type_ids.append(token_type_ids)
-            self.attention_mask.append(attention_mask)
-            self.origin_labels.append(origin_label)
-            # self.matched_word_ids.append(matched_word_ids)
-            # self.matched_word_mask.append(matched_word_mask)
-            # self.matched_word_label_ids.append(matched_word_label_ids)
-            self.input_labels.append(input_labels)
-            self.labels.append(labels)
+        line_total = FileReader(self.file).line_size()
+        names = ["input_token_ids", "token_type_ids", "attention_mask", "input_labels", "origin_labels", "labels"]
+
+        def rows():
+            return tqdm(map_ordered(self.convert_line, FileUtil.line_iter(self.file), self.num_processes),
+                        desc=f"load dataset from {self.file}", total=line_total)
+
+        fields = DatasetStore.load_or_build(self.store_path, names, rows, line_total)
+        for name in names:
+            setattr(self, name, fields[name])
         self.size = len(self.input_token_ids)
-        self.input_token_ids = np.array(self.input_token_ids)
-        self.token_type_ids = np.array(self.token_type_ids)
-        self.attention_mask = np.array(self.attention_mask)
-        self.origin_labels = np.array(self.origin_labels)
-        # self.matched_word_ids = np.array(self.matched_word_ids)
-        # self.matched_word_mask = np.array(self.matched_word_mask)
-        # self.matched_word_label_ids = np.array(self.matched_word_label_ids)
-        self.input_labels = np.array(self.input_labels)
-        self.labels = np.array(self.labels)
         self.indexes = [i for i in range(self.size)]
         if self.do_shuffle:
             random.shuffle(self.indexes)
@@ -18,6 +18,8 @@ class LXLoader(IDataLoader):
             .add_argument("eval_batch_size", int, defaultValue=16) \
             .add_argument("test_batch_size", int, defaultValue=16) \
             .add_argument("word_embedding_file", str) \
+            .add_argument("word_embedding_store", str, optional=True) \
+            .add_argument("embedding_dtype", str, defaultValue="float32") \
             .add_argument("word_vocab_file", str) \
             .add_argument("word_vocab_file_with_tag", str) \
             .add_argument("train_file", str) \
@@ -27,6 +29,11 @@ class LXLoader(IDataLoader):
             .add_argument("bert_vocab_file", str) \
             .add_argument("output_eval", bool, defaultValue=True) \
             .add_argument("max_scan_num", int, defaultValue=1000000) \
+            .add_argument("use_double_array_trie", bool, defaultValue=False) \
+            .add_argument("num_processes", int, defaultValue=1) \
+            .add_argument("cache_max_size", int, optional=True, description="maximum bytes of ./temp/artifacts") \
+            .add_argument("shared_cache_dir", str, optional=True, description="shared memory tier, e.g. /dev/shm/cc_artifacts") \
+            .add_argument("cache_fingerprint", str, defaultValue="etag", description="etag: md5 of the data files, hashed once per version, fast: size, mtime, inode and sampled blocks") \
             .add_argument("add_seq_vocab", bool, defaultValue=False) \
             .add_argument("max_seq_length", int, defaultValue=256) \
             .add_argument("max_word_num", int, defaultValue=5) \
@@ -43,10 +50,7 @@ class LXLoader(IDataLoader):
             .add_argument("skip_single_matched_word",bool,defaultValue=False) \
             .parse(self, **args)
 
-        files = [self.train_file,self.eval_file,self.test_file,self.tag_file] 
-        self.cache_key = [FileReader(file).etag() if file is not None else "None" for file in files]
-        self.cache_key = "_".join(self.cache_key)
-        self.cache = FileCache(f"./temp/{self.cache_key}")
+        self.cache = ArtifactCache(max_size=self.cache_max_size, shared_dir=self.shared_cache_dir, fingerprint=self.cache_fingerprint)
 
         self.read_data_set()
         self.verify_data()
@@ -55,16 +59,25 @@ class LXLoader(IDataLoader):
     def read_data_set(self):
         self.data_files = [self.train_file, self.eval_file, self.test_file]
         
-        cache = self.cache.group(self.max_scan_num)
+        cache = self.cache
         # loading lexicon tree
-        self.lexicon_tree = cache.load("lexicon_tree",lambda: TrieFactory.get_trie_from_vocabs(
-            [self.word_vocab_file], self.max_scan_num))
+        if self.use_double_array_trie:
+            self.lexicon_tree = TrieFactory.get_double_array_trie_from_vocabs(
+                [self.word_vocab_file], self.max_scan_num, cache.group(
+                    "lexicon_tree", paths=[self.word_vocab_file],
+                    params={"max_scan_num": self.max_scan_num, "double_array": True}).root)
+        else:
+            self.lexicon_tree = cache.load("lexicon_tree",lambda: TrieFactory.get_trie_from_vocabs(
+                [self.word_vocab_file], self.max_scan_num),
+                paths=[self.word_vocab_file], params={"max_scan_num": self.max_scan_num})
 
         self.matched_words: List[str] = cache.load("matched_words",lambda: TrieFactory.get_all_matched_word_from_dataset(
-            self.data_files, self.lexicon_tree))
+            self.data_files, self.lexicon_tree, self.num_processes),
+            files=self.data_files, deps=["lexicon_tree"])
         # restore all word_vocab_file_with_tag
         self.word_vocab = cache.load("word_vocab_tag",lambda: VocabTag().from_files(
-            [self.word_vocab_file_with_tag], is_word=True, has_default=False, unk_num=5, max_scan_num=self.max_scan_num))
+            [self.word_vocab_file_with_tag], is_word=True, has_default=False, unk_num=5, max_scan_num=self.max_scan_num),
+            paths=[self.word_vocab_file_with_tag], params={"max_scan_num": self.max_scan_num})
 
         matched_words_with_tags = [(word, self.word_vocab.tag(word))
                                    for word in self.matched_words]
@@ -74,12 +87,14 @@ class LXLoader(IDataLoader):
 
         self.tag_vocab = Vocab().from_files([self.tag_file])
 
-        self.vocab_embedding, self.embedding_dim = cache.load("word_embedding",lambda: VocabEmbedding(self.word_vocab).build_from_file(
-            self.word_embedding_file, self.max_scan_num, self.add_seq_vocab).get_embedding())
+        self.vocab_embedding, self.embedding_dim = cache.load("word_embedding",lambda: VocabEmbedding(self.word_vocab, self.embedding_dtype).build_from_file(
+            self.word_embedding_file, self.max_scan_num, self.add_seq_vocab, self.word_embedding_store, self.num_processes).get_embedding(),
+            paths=[self.word_embedding_file], params={"max_scan_num": self.max_scan_num, "add_seq_vocab": self.add_seq_vocab, "embedding_dtype": self.embedding_dtype}, deps=["matched_words", "word_vocab_tag"])
 
         self.tag_convert: TagConvert = TagConvert(
             self.tag_rules, not_found_action="return" if self.pass_none_rule else "exception")
         self.tokenizer = BertTokenizer.from_pretrained(self.bert_vocab_file)
+        self.char_ids = CharIdTable.from_tokenizer(self.tokenizer)
 
     def verify_data(self):
         pass
@@ -220,9 +235,9 @@ class LEXBertDataSet(Dataset):
             text[-1] = "[SEP]"
             origin_text[-1] = "[SEP]"
             # convert to ids
-            token_ids = self.tokenizer.convert_tokens_to_ids(text)
-            label_ids = self.tag_vocab.token2id(label)
-            origin_text = self.tokenizer.convert_tokens_to_ids(origin_text)
+            token_ids = self.char_ids.convert_tokens_to_ids(text)
+            label_ids = self.tag_vocab.tokens2ids(label)
+            origin_text = self.char_ids.convert_tokens_to_ids(origin_text)
 
             labels = []
             for m, token_id in zip(mask, origin_text):
@@ -2,10 +2,17 @@ from .cache_manager import *
 from .reader import *
 from .file_util import *
 from .lexicon_tree import *
+from .double_array_trie import *
 from .lexicon_factory import *
 from .vocab import *
 from .vocab_tag import *
+from .char_table import *
 from .embedding import *
+from .dataset_store import *
+from .collate import *
+from .sampler import *
+from .prefetch import *
+from .streaming import *
 from .parser import *
 from .tag_convert import *
 from .label_collections import *
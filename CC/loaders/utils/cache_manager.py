@@ -1,16 +1,69 @@
 from __future__ import annotations
+from hashlib import md5
+import json
+import mmap
 import os
 import pickle
-from typing import Any
+import shutil
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from .reader import FileReader
+
+
+@contextmanager
+def _atomic_write(path: str, mode: str = "wb"):
+    # written to a temporary file and renamed, so readers never see a partial file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, mode, encoding=None if "b" in mode else "utf-8") as f:
+            yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class CacheStats():
+    """counters of a cache and its groups
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.build_time = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.evictions = 0
+
+    def __repr__(self) -> str:
+        return json.dumps(vars(self), indent=4)
 
 
 class FileCache():
+    """pickle cache in a directory.
 
-    def __init__(self,dir="./temp",debug=True) -> None:
+    objects are written to a temporary file and renamed, so a crash never leaves a
+    partial entry. pickle protocol 5 keeps NumPy buffers out of band, they are
+    memory-mapped copy-on-write on load. with max_size, the least recently used
+    entries of the root directory are evicted after each save, except pinned entries
+    such as metadata files and the entries loaded or saved by this process.
+    """
+    MAGIC = b"CCPK5\n"
+    ALIGNMENT = 64
+
+    def __init__(self,dir="./temp",debug=True,max_size:int=None,stats:CacheStats=None,parent:FileCache=None) -> None:
         if not os.path.exists(dir):
-            os.makedirs(dir)
+            os.makedirs(dir, exist_ok=True)
         self.root = dir
         self.debug = debug
+        self.max_size = max_size
+        self.stats = stats if stats is not None else CacheStats()
+        self.parent = parent
+        self.pinned = set()
 
     def exists(self,key:str)->bool:
         path = self._get_path(f"{key}")
@@ -20,26 +73,316 @@ class FileCache():
         path = self._get_path(f"{key}")
         if self.exists(key) and not overwrite:
             return False
-        with open(path,"wb") as f:
-            pickle.dump(obj,f)
+        buffers = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        buffers = [buffer.raw() for buffer in buffers]
+        header = struct.pack(f"<{len(buffers)+2}Q", len(buffers), len(data), *[len(b) for b in buffers])
+        with _atomic_write(path) as f:
+            f.write(self.MAGIC)
+            f.write(header)
+            f.write(data)
+            for buffer in buffers:
+                f.write(b"\0" * (-f.tell() % self.ALIGNMENT))
+                f.write(buffer)
+            size = f.tell()
+        self.stats.bytes_written += size
+        self.touch(key)
+        self._get_top().evict(keep=path)
         return True
 
     def load(self,key,construct=None)->Any:
         path = self._get_path(f"{key}")
         if self.exists(key):
-            with open(path,"rb") as f:
-                if self.debug:
-                    print(f"load cached {path}")
-                return pickle.load(f)
+            if self.debug:
+                print(f"load cached {path}")
+            try:
+                obj = self._read(path)
+                self.stats.hits += 1
+                self.touch(key)
+                return obj
+            except (pickle.UnpicklingError, EOFError, struct.error, ValueError) as e:
+                print(f"drop corrupt cache {path}: {e}")
+                os.remove(path)
+        self.stats.misses += 1
         if construct is not None:
+            start = time.time()
             obj = construct()
-            self.save(key,obj)
+            self.stats.build_time += time.time() - start
+            self.save(key,obj,overwrite=True)
             return obj
         return None
 
+    def touch(self,key:str):
+        """mark an entry as recently used, entries of the root directory are pinned for this process
+
+        Args:
+            key (str): entry key
+        """
+        path = self._get_path(f"{key}")
+        if os.path.exists(path):
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        if self.parent is not None:
+            self.parent.touch(os.path.basename(self.root))
+        else:
+            self.pin(key)
+
+    def pin(self,key:str):
+        """never evict an entry of the root directory in this process
+
+        Args:
+            key (str): entry key
+        """
+        self.pinned.add(os.path.abspath(self._get_path(f"{key}")))
+
     def group(self,key)->FileCache:
         path = self._get_path(f"{key}")
-        return FileCache(path)
-        
+        cache = FileCache(path,self.debug,stats=self.stats,parent=self)
+        self.touch(key)
+        return cache
+
+    def size(self) -> int:
+        """bytes of all entries
+
+        Returns:
+            int: bytes
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self,max_size:int=None,keep:str=None) -> int:
+        """remove the least recently used entries until the cache is not larger than max_size
+
+        Args:
+            max_size (int, optional): maximum bytes. Defaults to self.max_size.
+            keep (str, optional): path of an entry never evicted. Defaults to None.
+
+        Returns:
+            int: number of evicted entries
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return 0
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= max_size:
+                break
+            if os.path.abspath(path) in self.pinned:
+                continue
+            if keep is not None and os.path.commonpath([os.path.abspath(path), os.path.abspath(keep)]) == os.path.abspath(path):
+                continue
+            if self.debug:
+                print(f"evict cache {path}")
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            total -= size
+            evicted += 1
+        self.stats.evictions += evicted
+        return evicted
+
+    def _read(self,path:str)->Any:
+        with open(path,"rb") as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                # written by an older version with pickle.dump
+                f.seek(0)
+                obj = pickle.load(f)
+                self.stats.bytes_read += f.tell()
+                return obj
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        view = memoryview(buffer)
+        offset = len(self.MAGIC)
+        count, data_size = struct.unpack_from("<2Q", view, offset)
+        sizes = struct.unpack_from(f"<{count}Q", view, offset + 16)
+        offset += 16 + 8 * count
+        data = view[offset:offset + data_size]
+        offset += data_size
+        buffers = []
+        for size in sizes:
+            offset += -offset % self.ALIGNMENT
+            buffers.append(view[offset:offset + size])
+            offset += size
+        if offset > len(view):
+            raise EOFError(f"truncated cache {path}")
+        self.stats.bytes_read += len(view)
+        return pickle.loads(data, buffers=buffers)
+
+    def _entries(self) -> List[Tuple[str, int, int]]:
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".tmp"):
+                continue
+            path = self._get_path(name)
+            try:
+                stat = os.stat(path)
+                size = stat.st_size
+                if os.path.isdir(path):
+                    size = 0
+                    for dir, _, files in os.walk(path):
+                        for file in files:
+                            size += os.path.getsize(os.path.join(dir, file))
+                entries.append((path, size, stat.st_atime_ns))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def _get_top(self) -> FileCache:
+        cache = self
+        while cache.parent is not None:
+            cache = cache.parent
+        return cache
+
     def _get_path(self,key:str)->str:
         return os.path.join(self.root,key)
+
+
+class ArtifactCache():
+    """Cache of artifacts keyed by a hash of their declared inputs, so unchanged
+    artifacts are reused across datasets and runs.
+
+    inputs of an artifact:
+        files: hashed by content etag, or by FileReader.fingerprint with fingerprint="fast"
+        paths: large resources hashed by path, size and mtime
+        params: json serializable parameters
+        deps: names of upstream artifacts loaded from the same cache
+
+    with shared_dir (e.g. /dev/shm/cc_artifacts), artifacts backed by NumPy buffers, such as
+    embedding matrices, are published to a shared memory tier. their buffers are memory-mapped,
+    so concurrent jobs on one host attach to the same pages instead of holding a copy each.
+    other artifacts (tries, vocabs, word lists) are rebuilt by unpickling in every process,
+    they stay on the disk tier only.
+
+    etags are recorded in etags.json with the size, mtime and inode of the file, so a file
+    is hashed once per version.
+    """
+
+    def __init__(self, dir="./temp/artifacts", debug=True, max_size: int = None, shared_dir: str = None, fingerprint: str = "etag") -> None:
+        assert fingerprint in ["etag", "fast"], f"fingerprint {fingerprint} not in ['etag', 'fast']"
+        self.cache = FileCache(dir, debug, max_size)
+        self.root = self.cache.root
+        self.debug = debug
+        self.stats = self.cache.stats
+        self.shared = FileCache(shared_dir, debug, max_size) if shared_dir is not None else None
+        self.keys: Dict[str, str] = {}
+        self.fingerprint = fingerprint
+        self._fingerprints: Dict[str, str] = {}
+        self._etag_lock = threading.Lock()
+        self.cache.pin("etags.json")
+
+    def key(self, name: str, files: List[str] = None, paths: List[str] = None, params: Dict[str, Any] = None, deps: List[str] = None) -> str:
+        """get the key of an artifact and record it for downstream artifacts
+
+        Args:
+            name (str): artifact name
+            files (List[str], optional): input files, None items are allowed. Defaults to None.
+            paths (List[str], optional): input resources. Defaults to None.
+            params (Dict[str, Any], optional): parameters. Defaults to None.
+            deps (List[str], optional): upstream artifact names. Defaults to None.
+
+        Returns:
+            str: key of the artifact
+        """
+        for dep in deps or []:
+            if dep not in self.keys:
+                raise KeyError(f"artifact {name} depends on {dep} which is not loaded")
+        inputs = {
+            "name": name,
+            "files": [self._fingerprint(file) for file in files or []],
+            "paths": [self._stat(path) for path in paths or []],
+            "params": params or {},
+            "deps": [self.keys[dep] for dep in deps or []]
+        }
+        key = md5(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        self.keys[name] = key
+        return key
+
+    def exists(self, name: str, **inputs) -> bool:
+        return self.cache.exists(self._get_key(name, **inputs))
+
+    def load(self, name: str, construct=None, **inputs) -> Any:
+        """load an artifact, construct and save it on miss
+
+        Args:
+            name (str): artifact name
+            construct (Callable, optional): artifact constructor. Defaults to None.
+            **inputs: files, paths, params and deps, see key
+
+        Returns:
+            Any: artifact
+        """
+        key = self._get_key(name, **inputs)
+        if self.shared is None:
+            return self.cache.load(key, construct)
+        if self.shared.exists(key):
+            obj = self.shared.load(key)
+            if obj is not None:
+                return obj
+        obj = self.cache.load(key, construct)
+        if not self._is_shareable(obj):
+            return obj
+        self.shared.save(key, obj, overwrite=True)
+        # attach to the published copy so the private one can be freed
+        return self.shared.load(key)
+
+    def group(self, name: str, **inputs) -> FileCache:
+        """get the directory cache of an artifact which manages its own files
+
+        Args:
+            name (str): artifact name
+            **inputs: files, paths, params and deps, see key
+
+        Returns:
+            FileCache: cache in the artifact directory
+        """
+        return self.cache.group(self._get_key(name, **inputs))
+
+    def _is_shareable(self, obj: Any) -> bool:
+        # NumPy arrays, alone or in a tuple such as (embedding, dim), are pickled out of band
+        if isinstance(obj, tuple):
+            return any(self._is_shareable(item) for item in obj)
+        return isinstance(obj, np.ndarray) and obj.dtype != object
+
+    def _get_key(self, name: str, **inputs) -> str:
+        return f"{name}_{self.key(name, **inputs)}"
+
+    def _fingerprint(self, file: str) -> str:
+        if file is None:
+            return "None"
+        if file not in self._fingerprints:
+            if self.fingerprint == "fast":
+                self._fingerprints[file] = FileReader(file).fingerprint()
+            else:
+                self._fingerprints[file] = self._etag(file)
+        return self._fingerprints[file]
+
+    def _etag(self, file: str) -> str:
+        stat = os.stat(file)
+        version = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        record = self._load_etags().get(os.path.abspath(file))
+        if record is not None and record["version"] == version:
+            return record["etag"]
+        etag = FileReader(file).etag()
+        with self._etag_lock:
+            # read again, another thread or process may have recorded other files meanwhile
+            records = self._load_etags()
+            records[os.path.abspath(file)] = {"version": version, "etag": etag}
+            with _atomic_write(os.path.join(self.root, "etags.json"), "w") as f:
+                json.dump(records, f)
+        return etag
+
+    def _load_etags(self) -> Dict[str, Any]:
+        path = os.path.join(self.root, "etags.json")
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def _stat(self, path: str) -> List[Any]:
+        if path is None:
+            return ["None"]
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
@@ -0,0 +1,67 @@
+from __future__ import annotations
+from typing import Dict, List
+import numpy as np
+
+
+class CharIdTable():
+    """dense table from unicode code point to vocab id, converts character tokens with one numpy lookup.
+
+    tokens of a single character are looked up in the table, other tokens such as [CLS], [SEP] and
+    [MASK] fall back to the vocab dict. unknown tokens get the id of unk_token, same as
+    BertTokenizer.convert_tokens_to_ids.
+    """
+
+    def __init__(self, vocab: Dict[str, int], unk_token: str = "[UNK]"):
+        """
+        Args:
+            vocab (Dict[str, int]): token to id
+            unk_token (str, optional): token of unknown characters, KeyError is raised if it is not in vocab. Defaults to "[UNK]".
+        """
+        self.vocab: Dict[str, int] = vocab
+        self.unk_token: str = unk_token
+        self.unk_id: int = vocab.get(unk_token, -1)
+        chars = {ord(token): idx for token, idx in vocab.items() if len(token) == 1}
+        self.table: np.ndarray = np.full(max(chars, default=0) + 1, self.unk_id, dtype=np.int64)
+        self.table[list(chars.keys())] = list(chars.values())
+
+    @staticmethod
+    def from_tokenizer(tokenizer) -> CharIdTable:
+        return CharIdTable(tokenizer.vocab, tokenizer.unk_token)
+
+    def encode(self, text: str) -> np.ndarray:
+        """ids of every character of text"""
+        return self._check(self._lookup(np.frombuffer(text.encode("utf-32-le"), dtype="<u4")))
+
+    def convert_tokens_to_ids(self, tokens: List[str]) -> np.ndarray:
+        """ids of tokens, single characters or special tokens
+
+        Args:
+            tokens (List[str]): tokens, e.g. ["[CLS]", "中", "文", "[SEP]"]
+
+        Returns:
+            np.ndarray: ids
+        """
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+        codes = np.frombuffer("".join(tokens).encode("utf-32-le"), dtype="<u4")
+        if len(codes) == len(tokens) and (len(tokens) == 0 or lengths.min() == 1):
+            return self._check(self._lookup(codes))
+        # first code point of every token, the other tokens are looked up in vocab
+        starts = np.cumsum(lengths) - lengths
+        single = lengths == 1
+        ids = np.empty(len(tokens), dtype=np.int64)
+        ids[single] = self._lookup(codes[starts[single]])
+        for i in np.flatnonzero(~single).tolist():
+            ids[i] = self.vocab.get(tokens[i], self.unk_id)
+        return self._check(ids)
+
+    def _lookup(self, codes: np.ndarray) -> np.ndarray:
+        if len(codes) == 0 or codes.max() < len(self.table):
+            return self.table[codes]
+        ids = self.table[np.minimum(codes, len(self.table) - 1)]
+        ids[codes >= len(self.table)] = self.unk_id
+        return ids
+
+    def _check(self, ids: np.ndarray) -> np.ndarray:
+        if self.unk_id < 0 and len(ids) > 0 and ids.min() < 0:
+            raise KeyError(f"unknown token and no {self.unk_token} in vocab")
+        return ids
@@ -1,6 +1,7 @@
 import re
 import json
 import random
+from .char_table import CharIdTable
 
 class DataManager():
 
@@ -17,6 +18,12 @@ class DataManager():
         except:
             return self.word_to_idx['[UNK]']
     
+    def wordsToIdx(self, words):
+        # one table lookup for the whole list, same ids as wordToIdx
+        if getattr(self, 'char_ids', None) is None:
+            self.char_ids = CharIdTable(self.word_to_idx, unk_token='[UNK]')
+        return self.char_ids.convert_tokens_to_ids(words).tolist()
+
     def idxToWord(self, idx):
         try:
             return self.idx_to_word[idx]
@@ -0,0 +1,104 @@
+from typing import Any, Dict, List
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+
+def collate_batch(batch: List[Dict[str, Any]], max_word_num: int = None, dynamic_padding: bool = False) -> Dict[str, torch.Tensor]:
+    """stack samples into a batch, integer fields stored in compact dtypes (uint8 masks, int16 labels,
+    int32 ids) are upcast to int64 here instead of in the dataset.
+
+    sparse matched word lattices are densified for this batch only:
+        matched_word_lattice: [k, 3] rows of (position, slot, word_id)
+            -> matched_word_ids, matched_word_mask [batch, seq_length, max_word_num]
+        matched_label_lattice_ids: [k] or [k, max_label_num] labels of each lattice row
+            -> matched_label_ids [batch, seq_length, max_word_num] or [batch, seq_length, max_word_num, max_label_num]
+        matched_label_lattice_mask: [k, max_label_num] label mask of each lattice row
+            -> matched_label_mask [batch, seq_length, max_word_num, max_label_num]
+        matched_label_lattice_pairs: [k, max_label_num] rows of the label embedding table, 0 for none
+            -> matched_label_pair_ids [batch, seq_length, max_word_num, max_label_num]
+
+    Args:
+        batch (List[Dict[str, Any]]): samples of tensors or numpy arrays
+        max_word_num (int, optional): matched words per position, required for lattices. Defaults to None.
+        dynamic_padding (bool, optional): trim sequence fields to the longest sequence of the batch,
+            see trim_batch. Defaults to False.
+
+    Returns:
+        Dict[str, torch.Tensor]: batch
+    """
+    lattice_names = ["matched_word_lattice", "matched_label_lattice_ids", "matched_label_lattice_mask",
+                     "matched_label_lattice_pairs"]
+    lattices = {name: [sample[name] for sample in batch] for name in lattice_names if name in batch[0]}
+    batch = default_collate([{name: value for name, value in sample.items() if name not in lattices}
+                             for sample in batch])
+    batch = {name: value if value.is_floating_point() else value.long() for name, value in batch.items()}
+    if dynamic_padding:
+        batch = trim_batch(batch)
+    if "matched_word_lattice" in lattices:
+        assert max_word_num is not None, "max_word_num is required to densify matched word lattices"
+        batch.update(densify_lattice(lattices, batch["input_ids"].shape[1], max_word_num))
+    return batch
+
+
+def trim_batch(batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    """trim every field padded to max_seq_length, i.e. with max_seq_length as its second dimension,
+    to the last position attended by any sample of the batch
+
+    Args:
+        batch (Dict[str, torch.Tensor]): batch with input_ids and attention_mask [batch, max_seq_length]
+
+    Returns:
+        Dict[str, torch.Tensor]: trimmed batch
+    """
+    seq_length = batch["input_ids"].shape[1]
+    positions = batch["attention_mask"].gt(0).any(dim=0).nonzero()
+    length = int(positions.max()) + 1 if len(positions) > 0 else 1
+    if length == seq_length:
+        return batch
+    return {name: value[:, :length] if value.dim() > 1 and value.shape[1] == seq_length else value
+            for name, value in batch.items()}
+
+
+def densify_lattice(lattices: Dict[str, List[np.ndarray]], seq_length: int, max_word_num: int) -> Dict[str, torch.Tensor]:
+    """scatter the lattice rows of a batch into dense tensors, see collate_batch
+
+    Args:
+        lattices (Dict[str, List[np.ndarray]]): lattice fields of each sample
+        seq_length (int): sequence length of the batch
+        max_word_num (int): matched words per position
+
+    Returns:
+        Dict[str, torch.Tensor]: dense matched word (and label) tensors
+    """
+    words = lattices["matched_word_lattice"]
+    size = len(words)
+    index = torch.from_numpy(np.concatenate([np.full(len(rows), i) for i, rows in enumerate(words)])).long()
+    rows = torch.from_numpy(np.concatenate([np.asarray(rows).reshape(-1, 3) for rows in words])).long()
+    position, slot = rows[:, 0], rows[:, 1]
+    matched_word_ids = torch.zeros(size, seq_length, max_word_num, dtype=torch.long)
+    matched_word_ids[index, position, slot] = rows[:, 2]
+    matched_word_mask = torch.zeros(size, seq_length, max_word_num, dtype=torch.long)
+    matched_word_mask[index, position, slot] = 1
+    dense = {"matched_word_ids": matched_word_ids, "matched_word_mask": matched_word_mask}
+    if "matched_label_lattice_ids" in lattices:
+        label_ids = torch.from_numpy(np.concatenate(lattices["matched_label_lattice_ids"])).long()
+        matched_label_ids = torch.zeros((size, seq_length, max_word_num) + tuple(label_ids.shape[1:]), dtype=torch.long)
+        matched_label_ids[index, position, slot] = label_ids
+        dense["matched_label_ids"] = matched_label_ids
+    if "matched_label_lattice_mask" in lattices:
+        label_mask = torch.from_numpy(np.concatenate(lattices["matched_label_lattice_mask"])).float()
+        max_label_num = label_mask.shape[1]
+        # as in the dense FTDataSetV1 layout, the union of the label masks of a position
+        # is shared by its first max_label_num word slots
+        position_mask = torch.zeros(size, seq_length, max_label_num)
+        position_mask.index_put_((index, position), label_mask, accumulate=True)
+        matched_label_mask = torch.zeros(size, seq_length, max_word_num, max_label_num)
+        matched_label_mask[:, :, :max_label_num] = position_mask.clamp(max=1).unsqueeze(2)
+        dense["matched_label_mask"] = matched_label_mask
+    if "matched_label_lattice_pairs" in lattices:
+        pair_ids = torch.from_numpy(np.concatenate(lattices["matched_label_lattice_pairs"])).long()
+        matched_label_pair_ids = torch.zeros(size, seq_length, max_word_num, pair_ids.shape[1], dtype=torch.long)
+        matched_label_pair_ids[index, position, slot] = pair_ids
+        dense["matched_label_pair_ids"] = matched_label_pair_ids
+    return dense
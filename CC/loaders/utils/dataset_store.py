@@ -0,0 +1,207 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+import numpy as np
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+
+
+class RaggedArray():
+    """rows of different lengths stored as concatenated values and row offsets,
+    row i is values[offsets[i]:offsets[i+1]]
+    """
+
+    def __init__(self, values: np.ndarray, offsets: np.ndarray):
+        self.values: np.ndarray = values
+        self.offsets: np.ndarray = offsets
+
+    @staticmethod
+    def from_rows(rows: List[np.ndarray]) -> RaggedArray:
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(row) for row in rows])
+        values = np.concatenate(rows) if len(rows) > 0 else np.empty(0, dtype=np.int64)
+        return RaggedArray(values, offsets)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.values[self.offsets[index]:self.offsets[index+1]]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+class DatasetStore():
+    """Converted dataset saved as one .npy file per field, fields are memory-mapped on load.
+    ragged fields, e.g. matched word lattices, are saved as {name}.npy values and {name}.offsets.npy.
+
+    meta.json is written after all fields, a directory without it is rebuilt.
+    """
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return path is not None and os.path.exists(os.path.join(path, "meta.json"))
+
+    @staticmethod
+    def save(path: str, names: List[str], rows: Iterable[Sequence[np.ndarray]], size: int, ragged: List[str] = []) -> Dict[str, Any]:
+        """write converted rows
+
+        Args:
+            path (str): store directory
+            names (List[str]): field names, in the order of the arrays of each row
+            rows (Iterable[Sequence[np.ndarray]]): converted rows
+            size (int): maximum number of rows, the line count of the dataset file
+            ragged (List[str], optional): fields whose first dimension differs between rows. Defaults to [].
+
+        Returns:
+            Dict[str, Any]: memory-mapped fields, RaggedArray for ragged fields
+        """
+        # built in a temporary sibling directory and renamed, so a crash or a concurrent build
+        # never leaves a partial store in path
+        temp_path = f"{path.rstrip(os.sep)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        try:
+            fields, count = DatasetStore._fill(names, rows, size, ragged, lambda name, dtype, shape: np.lib.format.open_memmap(
+                os.path.join(temp_path, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape))
+            for name, field in fields.items():
+                if name in ragged:
+                    np.save(os.path.join(temp_path, f"{name}.npy"), field.values)
+                    np.save(os.path.join(temp_path, f"{name}.offsets.npy"), field.offsets)
+                else:
+                    field.flush()
+            del fields
+            with open(os.path.join(temp_path, "meta.json"), "w") as f:
+                json.dump({"size": count, "names": names, "ragged": ragged}, f)
+            DatasetStore._replace(temp_path, path)
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        return DatasetStore.load(path)
+
+    @staticmethod
+    def load(path: str) -> Dict[str, Any]:
+        meta = DatasetStore.load_meta(path)
+        fields = {}
+        for name in meta["names"]:
+            # copy-on-write mapping, rows can be modified without touching the file
+            values = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")
+            if name in meta.get("ragged", []):
+                fields[name] = RaggedArray(values, np.load(os.path.join(path, f"{name}.offsets.npy")))
+            else:
+                fields[name] = values[:meta["size"]]
+        return fields
+
+    @staticmethod
+    def load_meta(path: str) -> Dict[str, Any]:
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f)
+
+    @staticmethod
+    def load_or_build(path: str, names: List[str], rows: Callable[[], Iterable[Sequence[np.ndarray]]], size: int, ragged: List[str] = []) -> Dict[str, Any]:
+        """load the store in path, or build it from rows. without path the fields are stacked in memory.
+        a store saved with other fields is rebuilt
+
+        Args:
+            path (str): store directory, None to skip the store
+            names (List[str]): field names
+            rows (Callable[[], Iterable[Sequence[np.ndarray]]]): iterator of converted rows, called on miss
+            size (int): maximum number of rows
+            ragged (List[str], optional): fields whose first dimension differs between rows. Defaults to [].
+
+        Returns:
+            Dict[str, Any]: fields, RaggedArray for ragged fields
+        """
+        if path is None:
+            fields, count = DatasetStore._fill(names, rows(), size, ragged, lambda name, dtype, shape: np.empty(shape, dtype=dtype))
+            return {name: field if name in ragged else field[:count] for name, field in fields.items()}
+        if DatasetStore.exists(path):
+            meta = DatasetStore.load_meta(path)
+            if meta["names"] == names and meta.get("ragged", []) == ragged:
+                return DatasetStore.load(path)
+        return DatasetStore.save(path, names, rows(), size, ragged)
+
+    @staticmethod
+    def _replace(temp_path: str, path: str):
+        # a directory is only renamed onto an empty one, so a previous store is moved aside first
+        old_path = f"{path.rstrip(os.sep)}.{os.getpid()}.{threading.get_ident()}.old.tmp"
+        try:
+            os.replace(path, old_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            # another process placed its store first
+            if not DatasetStore.exists(path):
+                raise
+        finally:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    @staticmethod
+    def _fill(names: List[str], rows: Iterable[Sequence[np.ndarray]], size: int, ragged: List[str], allocate) -> Tuple[Dict[str, Any], int]:
+        # dense fields are allocated from the shape and dtype of the first row, rows are copied in order
+        fields = None
+        ragged_rows = {name: [] for name in ragged}
+        count = 0
+        for row in rows:
+            if count >= size:
+                raise ValueError(f"more than {size} rows, size should count every line of the dataset file")
+            if fields is None:
+                fields = {name: allocate(name, np.asarray(value).dtype, (size,) + np.shape(value))
+                          for name, value in zip(names, row) if name not in ragged}
+            for name, value in zip(names, row):
+                if name in ragged:
+                    ragged_rows[name].append(value)
+                else:
+                    fields[name][count] = value
+            count += 1
+        if fields is None:
+            fields = {name: allocate(name, np.int64, (0,)) for name in names if name not in ragged}
+        for name in ragged:
+            fields[name] = RaggedArray.from_rows(ragged_rows[name])
+        return {name: fields[name] for name in names}, count
+
+
+def map_ordered(fn: Callable[[Any], Any], items: Iterable[Any], num_processes: int = 1, chunk_size: int = 64) -> Iterator[Any]:
+    """apply fn to items in worker processes, results are yielded in the order of items
+
+    Args:
+        fn (Callable[[Any], Any]): conversion, inherited by forked workers, otherwise pickled once per worker
+        items (Iterable[Any]): items, e.g. lines of a dataset file
+        num_processes (int, optional): worker processes, 1 to convert in this process. Defaults to 1.
+        chunk_size (int, optional): items sent to a worker at once. Defaults to 64.
+
+    Yields:
+        Iterator[Any]: fn(item)
+    """
+    global _shared_map_fn
+    if num_processes <= 1:
+        yield from map(fn, items)
+        return
+    items = iter(items)
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    if "fork" in multiprocessing.get_all_start_methods():
+        _shared_map_fn = fn
+        pool = multiprocessing.get_context("fork").Pool(num_processes)
+    else:
+        pool = multiprocessing.Pool(num_processes, initializer=_init_map_worker, initargs=(fn,))
+    try:
+        for results in pool.imap(_map_chunk, chunks):
+            yield from results
+    finally:
+        pool.terminate()
+        pool.join()
+        _shared_map_fn = None
+
+
+_shared_map_fn: Callable[[Any], Any] = None
+
+
+def _init_map_worker(fn: Callable[[Any], Any]):
+    global _shared_map_fn
+    _shared_map_fn = fn
+
+
+def _map_chunk(chunk: List[Any]) -> List[Any]:
+    return [_shared_map_fn(item) for item in chunk]
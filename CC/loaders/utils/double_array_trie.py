@@ -0,0 +1,454 @@
+from __future__ import annotations
+from collections import Counter, deque
+from typing import Iterable, List
+from tqdm import tqdm
+import numpy as np
+import json
+import os
+import shutil
+import threading
+from .lexicon_tree import Trie, TrieNode
+
+
+class DoubleArrayTrie(Trie):
+    """Double-array lexicon trie stored in flat NumPy arrays
+
+    state s goes to t = base[s] + code(letter) when check[t] == s. The Aho-Corasick
+    fail/output links are stored beside base/check, so a trie is built once, saved
+    as .npy files and memory-mapped by every process that loads it.
+    """
+
+    array_names = ["base", "check", "fail", "output",
+                   "depth", "terminal", "alphabet"]
+
+    def __init__(self, use_single: bool = True):
+        """init an empty DoubleArrayTrie
+
+        Args:
+            use_single (bool, optional): True set self.min_len = 0,False set self.min_len = 1. Defaults to True.
+        """
+        self.max_depth: int = 0
+        self.min_len: int = 0 if use_single else 1
+        self.path: str = None
+        # words inserted after the arrays were built, merged in by compact()
+        self.overlay: Trie = Trie(use_single)
+        self.base = np.zeros(1, dtype=np.int32)
+        self.check = np.zeros(1, dtype=np.int32)
+        self.fail = np.zeros(1, dtype=np.int32)
+        self.output = np.full(1, -1, dtype=np.int32)
+        self.depth = np.zeros(1, dtype=np.int32)
+        self.terminal = np.zeros(1, dtype=np.uint8)
+        self.alphabet = np.zeros(0, dtype=np.int32)
+        # word_vocab ids of the word states, per process and never saved, see set_word_ids
+        self.word_vocab = None
+        self.word_ids: np.ndarray = None
+        self._bind()
+
+    @staticmethod
+    def from_words(words: Iterable[str], use_single: bool = True) -> DoubleArrayTrie:
+        """build the trie from words
+
+        Args:
+            words (Iterable[str]): words
+            use_single (bool, optional): same as Trie. Defaults to True.
+
+        Returns:
+            DoubleArrayTrie: builded trie
+        """
+        trie = DoubleArrayTrie(use_single)
+        trie._build(sorted(set(words)))
+        return trie
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> DoubleArrayTrie:
+        """load a saved trie
+
+        Args:
+            path (str): the directory written by save
+            mmap (bool, optional): memory-map the arrays instead of reading them. Defaults to True.
+
+        Returns:
+            DoubleArrayTrie: the trie
+        """
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        trie = DoubleArrayTrie(meta["min_len"] == 0)
+        trie.max_depth = meta["max_depth"]
+        for name in DoubleArrayTrie.array_names:
+            setattr(trie, name, np.load(os.path.join(path, f"{name}.npy"),
+                                        mmap_mode="r" if mmap else None))
+        trie.path = path if mmap else None
+        trie._bind()
+        return trie
+
+    def save(self, path: str):
+        """save the arrays into a directory, meta.json is written last. the directory is built
+        as a temporary sibling and renamed, so a crash or a concurrent save never leaves a partial
+        trie in path
+
+        Args:
+            path (str): directory
+        """
+        self.compact()
+        temp_path = f"{path.rstrip(os.sep)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        try:
+            for name in self.array_names:
+                np.save(os.path.join(temp_path, f"{name}.npy"), getattr(self, name))
+            with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "min_len": self.min_len,
+                    "max_depth": self.max_depth,
+                    "size": self.size
+                }, f)
+            # a directory is only renamed onto an empty one, so a previous trie is moved aside first
+            old_path = f"{path.rstrip(os.sep)}.{os.getpid()}.{threading.get_ident()}.old.tmp"
+            try:
+                os.replace(path, old_path)
+            except FileNotFoundError:
+                pass
+            try:
+                os.replace(temp_path, path)
+            except OSError:
+                # another process placed its trie first
+                if not DoubleArrayTrie.exists(path):
+                    raise
+            finally:
+                shutil.rmtree(old_path, ignore_errors=True)
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        return self
+
+    def __getstate__(self):
+        # a saved trie crosses process boundaries as its path and is mapped again
+        if self.path is not None and self.overlay.max_depth == 0:
+            return {
+                "path": self.path,
+                "word_vocab": self.word_vocab,
+                "word_ids": self.word_ids
+            }
+        state = self.__dict__.copy()
+        for name in ["codes", "_views", "_word_ids"]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        if "base" not in state:
+            self.__dict__.update(DoubleArrayTrie.load(state["path"]).__dict__)
+            self.word_vocab = state["word_vocab"]
+            self.word_ids = state["word_ids"]
+            self._bind()
+            return
+        self.__dict__.update(state)
+        self._bind()
+
+    def _bind(self):
+        self.size: int = len(self.check)
+        self.codes = {chr(c): i+1 for i, c in enumerate(self.alphabet.tolist())}
+        # memoryview indexing returns python ints, much cheaper than numpy scalars
+        self._views = tuple(memoryview(getattr(self, name)) for name in [
+            "base", "check", "fail", "output", "depth", "terminal"])
+        self._word_ids = memoryview(self.word_ids) if self.word_ids is not None else None
+
+    def _grow(self, capacity: int):
+        size = len(self.check)
+        if capacity <= size:
+            return
+        capacity = max(capacity, size * 2)
+        for name, fill in [("base", 0), ("check", -1), ("fail", 0), ("output", -1), ("depth", 0), ("terminal", 0)]:
+            array = getattr(self, name)
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:size] = array
+            setattr(self, name, grown)
+
+    def _find_base(self, codes: np.ndarray, next_free: int) -> int:
+        low, high = int(codes.min()), int(codes.max())
+        start = max(next_free - low, 1)
+        if len(codes) == 1 and start + low == next_free:
+            self._grow(next_free + 1)
+            return start
+        # test a window of bases at once, a base is blocked if any child slot is taken.
+        # nearly full windows are skipped by later searches, single children fill them
+        start = max(start, self._dense_until)
+        window = 4096
+        while True:
+            self._grow(start + window + high + 1)
+            occupied = self.check[start + low:start + window + high] >= 0
+            blocked = np.zeros(window, dtype=bool)
+            for code in codes.tolist():
+                blocked |= occupied[code - low:code - low + window]
+            hit = np.flatnonzero(~blocked)
+            if hit.size > 0:
+                return start + int(hit[0])
+            if start == self._dense_until and occupied[:window].mean() > 0.9:
+                self._dense_until += window
+            start += window
+
+    def _build(self, words: List[str]):
+        counter = Counter()
+        for word in words:
+            counter.update(word)
+        # frequent letters get small codes, which keeps the array dense
+        alphabet = [letter for letter, _ in counter.most_common()]
+        codes = {letter: i+1 for i, letter in enumerate(alphabet)}
+        self.alphabet = np.array([ord(letter) for letter in alphabet], dtype=np.int32)
+        self.base = np.zeros(1, dtype=np.int32)
+        self.check = np.zeros(1, dtype=np.int32)
+        self.fail = np.zeros(1, dtype=np.int32)
+        self.output = np.full(1, -1, dtype=np.int32)
+        self.depth = np.zeros(1, dtype=np.int32)
+        self.terminal = np.zeros(1, dtype=np.uint8)
+        self._grow(sum(counter.values()) + len(alphabet) + 1)
+        size = 1
+        next_free = 1
+        self._dense_until = 1
+        queue = deque([(0, 0, 0, len(words))])
+        with tqdm(total=len(words), desc="build double array trie") as bar:
+            while queue:
+                state, deep, lo, hi = queue.popleft()
+                # words are sorted, so the word equal to the prefix comes first
+                if lo < hi and len(words[lo]) == deep:
+                    self.terminal[state] = 1
+                    lo += 1
+                    bar.update(1)
+                if state != 0:
+                    if self.terminal[state] and deep > self.min_len:
+                        self.output[state] = state
+                    else:
+                        self.output[state] = self.output[self.fail[state]]
+                if lo >= hi:
+                    continue
+                letters, bounds = [], []
+                i = lo
+                while i < hi:
+                    letter = words[i][deep]
+                    j = i + 1
+                    while j < hi and words[j][deep] == letter:
+                        j += 1
+                    letters.append(letter)
+                    bounds.append((i, j))
+                    i = j
+                child_codes = np.array([codes[letter] for letter in letters], dtype=np.int64)
+                base = self._find_base(child_codes, next_free)
+                children = base + child_codes
+                self.base[state] = base
+                self.check[children] = state
+                self.depth[children] = deep + 1
+                size = max(size, int(children.max()) + 1)
+                self.max_depth = max(self.max_depth, deep + 1)
+                for code, child, (i, j) in zip(child_codes.tolist(), children.tolist(), bounds):
+                    fail = 0
+                    if state != 0:
+                        ptr = self.fail[state]
+                        while True:
+                            target = self.base[ptr] + code
+                            if target < len(self.check) and self.check[target] == ptr:
+                                fail = target
+                                break
+                            if ptr == 0:
+                                break
+                            ptr = self.fail[ptr]
+                    self.fail[child] = fail
+                    queue.append((child, deep + 1, i, j))
+                while next_free < len(self.check) and self.check[next_free] >= 0:
+                    next_free += 1
+        for name in ["base", "check", "fail", "output", "depth", "terminal"]:
+            setattr(self, name, np.ascontiguousarray(getattr(self, name)[:size]))
+        del self._dense_until
+        self.path = None
+        self._bind()
+        if self.word_vocab is not None:
+            self.set_word_ids(self.word_vocab)
+
+    def words(self) -> List[str]:
+        """all words stored in the arrays and the overlay
+
+        Returns:
+            List[str]: sorted words
+        """
+        states = np.flatnonzero(self.check >= 0)
+        states = states[states > 0]
+        parents = self.check[states]
+        letters = [chr(c) for c in self.alphabet[states - self.base[parents] - 1].tolist()]
+        children = {}
+        for parent, state, letter in zip(parents.tolist(), states.tolist(), letters):
+            children.setdefault(parent, []).append((state, letter))
+        words = set()
+        stack = [(0, "")]
+        while stack:
+            state, prefix = stack.pop()
+            if state != 0 and self.terminal[state]:
+                words.add(prefix)
+            for child, letter in children.get(state, []):
+                stack.append((child, prefix + letter))
+        stack = [(self.overlay.root, "")]
+        while stack:
+            node, prefix = stack.pop()
+            if node.is_word:
+                words.add(prefix)
+            for letter, child in node.children.items():
+                stack.append((child, prefix + letter))
+        return sorted(words)
+
+    def compact(self):
+        """merge the overlay words into the arrays
+        """
+        if self.overlay.max_depth > 0:
+            self._build(self.words())
+            self.overlay = Trie(self.min_len == 0)
+        return self
+
+    def insert(self, word: str):
+        """insert word, it is kept in the overlay until compact() or save()
+
+        Args:
+            word (str): the word
+        """
+        if not self._search(word):
+            self.overlay.insert(word)
+            self.max_depth = max(self.max_depth, self.overlay.max_depth)
+        return self
+
+    def _state(self, word: str) -> int:
+        base, check, _, _, _, _ = self._views
+        state = 0
+        for letter in word:
+            code = self.codes.get(letter)
+            if code is None:
+                return -1
+            target = base[state] + code
+            if target >= self.size or check[target] != state:
+                return -1
+            state = target
+        return state
+
+    def _search(self, word: str) -> bool:
+        state = self._state(word)
+        return state > 0 and self._views[5][state] == 1
+
+    def set_word_ids(self, vocab):
+        """store the word_vocab id of each word state, words missing in vocab
+        get the same unk id as vocab.token2id
+
+        Args:
+            vocab (Vocab): word vocab
+
+        Returns:
+            DoubleArrayTrie: self
+        """
+        unk_ids = np.array([vocab.unk_id(length)
+                            for length in range(self.max_depth + 1)], dtype=np.int32)
+        is_word = self.output == np.arange(self.size)
+        word_ids = np.where(is_word, unk_ids[self.depth], -1).astype(np.int32)
+        for word, idx in vocab.item2idx.items():
+            state = self._state(word)
+            if state > 0 and is_word[state]:
+                word_ids[state] = idx
+        self.word_vocab = vocab
+        self.word_ids = word_ids
+        self._word_ids = memoryview(self.word_ids)
+        self.overlay.set_word_ids(vocab)
+        return self
+
+    def search(self, word: str) -> bool:
+        """search word
+
+        Args:
+            word (str): the word
+
+        Returns:
+            bool: True if exist, otherwise False
+        """
+        return self._search(word) or self.overlay.search(word)
+
+    def _prefix_lengths(self, sent: str) -> List[int]:
+        base, check, _, _, _, terminal = self._views
+        lengths = []
+        state = 0
+        for i, letter in enumerate(sent):
+            code = self.codes.get(letter)
+            if code is None:
+                break
+            target = base[state] + code
+            if target >= self.size or check[target] != state:
+                break
+            state = target
+            if i >= self.min_len and terminal[state]:
+                lengths.append(i + 1)
+        if self.overlay.max_depth > 0:
+            ptr: TrieNode = self.overlay.root
+            for i, letter in enumerate(sent):
+                ptr = ptr.children.get(letter)
+                if ptr is None:
+                    break
+                if i >= self.min_len and ptr.is_word:
+                    lengths.append(i + 1)
+            lengths = sorted(set(lengths))
+        return lengths
+
+    def enumerateMatch(self, sent: str, space: str = "") -> List[str]:
+        """enumerate words starting with sent[0]
+
+        Args:
+            sent (str): the sent
+            space (str, optional): spilt string. Defaults to "".
+
+        Returns:
+            List[str]: the words starting with sent[0]. if there are more than one, remove the single word.
+        """
+        matched = [space.join(sent[:length])
+                   for length in self._prefix_lengths(sent)]
+        if len(matched) > 1 and len(matched[0]) == 1:
+            matched = matched[1:]
+        return matched
+
+    @property
+    def automaton(self) -> DoubleArrayTrie:
+        """the arrays carry the fail links, so the trie is its own automaton
+        """
+        return self
+
+    def match(self, sent: str, with_ids: bool = False) -> List[List[int]]:
+        """scan sent once from left to right, same as AhoCorasick.match
+
+        Args:
+            sent (str): the sent, a string or a list of tokens
+            with_ids (bool, optional): return (length, word_id) instead of length. Defaults to False.
+
+        Returns:
+            List[List[int]]: the lengths of the words starting at each position, in ascending order
+        """
+        base, check, fail, output, depth, _ = self._views
+        word_ids = self._word_ids if with_ids else None
+        size, codes = self.size, self.codes
+        matched: List[List[int]] = [[] for _ in range(len(sent))]
+        state = 0
+        for end, letter in enumerate(sent):
+            code = codes.get(letter)
+            if code is None:
+                state = 0
+                continue
+            while True:
+                target = base[state] + code
+                if target < size and check[target] == state:
+                    state = target
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            word_state = output[state]
+            while word_state > 0:
+                length = depth[word_state]
+                matched[end - length + 1].append(
+                    length if word_ids is None else (length, word_ids[word_state]))
+                word_state = output[fail[word_state]]
+        if self.overlay.max_depth > 0:
+            for start, lengths in enumerate(self.overlay.automaton.match(sent, with_ids)):
+                if len(lengths) > 0:
+                    matched[start] = sorted(set(matched[start] + lengths))
+        return matched
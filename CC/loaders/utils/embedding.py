@@ -1,6 +1,10 @@
+from __future__ import annotations
 from . import *
 import numpy as np
 from tqdm import *
+from typing import Dict, List, Tuple
+import json
+import multiprocessing
 import os
 import pickle
 
@@ -18,9 +22,8 @@ class WordEmbedding():
             max_scan_num = line_totals
         else:
             max_scan_num = min(max_scan_num, line_totals)
-        for index in tqdm(range(max_scan_num),desc="load word embedding...",
+        for index, line in tqdm(enumerate(self.reader.line_range(0, max_scan_num)),desc="load word embedding...",
                                 total=max_scan_num):
-            line = self.reader.line(index)
             line = line.strip().split()
             if index == 0:
                 self.dimension = int(line[1])
@@ -37,33 +40,302 @@ class WordEmbedding():
         return self.embedding_index, self.dimension, self.reader
 
 
+class WordEmbeddingStore():
+    """binary word embedding converted once from a text embedding file,
+    the float32 matrix is memory-mapped on load
+
+    files in the store directory:
+        embedding.bin: raw float32 matrix [rows, dimension]
+        words.txt: the word of each row
+        lines.npy: the line index of each row in the text file
+        meta.json: rows, dimension and the path and fingerprint of the text file
+    """
+
+    def __init__(self):
+        self.path: str = None
+        self.dimension: int = -1
+        self.embedding: np.ndarray = None
+        self.words: List[str] = []
+        self.lines: np.ndarray = None
+
+    @staticmethod
+    def exists(path: str, embedding_path: str = None) -> bool:
+        """whether a complete store is in path
+
+        Args:
+            path (str): store directory
+            embedding_path (str, optional): text embedding file the store must be converted from,
+                compared by FileReader.fingerprint. Defaults to None.
+
+        Returns:
+            bool: the store exists
+        """
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return False
+        if embedding_path is None:
+            return True
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        return meta.get("source") == WordEmbeddingStore.source(embedding_path)
+
+    @staticmethod
+    def source(embedding_path: str) -> Dict[str, str]:
+        return {"path": os.path.abspath(embedding_path), "fingerprint": FileReader(embedding_path).fingerprint()}
+
+    @staticmethod
+    def convert_from_txt(embedding_path: str, path: str, num_processes: int = 1, part_size: int = 64*1024*1024) -> WordEmbeddingStore:
+        """convert a text embedding file, the first line is the header "{rows} {dimension}".
+        byte ranges of the file are parsed in worker processes straight into the output matrix
+
+        Args:
+            embedding_path (str): text embedding file
+            path (str): store directory
+            num_processes (int, optional): parsing processes. Defaults to 1.
+            part_size (int, optional): approximate bytes parsed at once. Defaults to 64*1024*1024.
+
+        Returns:
+            WordEmbeddingStore: loaded store
+        """
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, "meta.json")):
+            # a store converted from another file, incomplete until meta.json is written again
+            os.remove(os.path.join(path, "meta.json"))
+        reader = FileReader(embedding_path)
+        with open(embedding_path, "rb") as f:
+            header = f.readline()
+        dimension = int(header.strip().split()[1])
+        ranges = reader.byte_ranges(part_size, start=len(header))
+        tasks = [(embedding_path, start, end, reader.encoding) for start, end in ranges]
+        pool = multiprocessing.Pool(num_processes) if num_processes > 1 else None
+        map_fn = pool.imap if pool is not None else map
+        # every line gets a row first, the rows of malformed lines are removed afterwards
+        first_lines = [1]
+        for count in map_fn(_count_embedding_lines, tasks):
+            first_lines.append(first_lines[-1] + count)
+        bin_path = os.path.join(path, "embedding.bin")
+        with open(bin_path, "wb") as f:
+            f.truncate((first_lines[-1] - 1) * dimension * 4)
+        tasks = [task + (first_line, dimension, bin_path) for task, first_line in zip(tasks, first_lines)]
+        words, lines = [], []
+        try:
+            with tqdm(total=reader.size(), desc="parse word embedding", unit="B", unit_scale=True, unit_divisor=1024) as bar:
+                for task, (part_words, part_lines, messages) in zip(tasks, map_fn(_parse_embedding_range, tasks)):
+                    for message in messages:
+                        print(message)
+                    words += part_words
+                    lines.append(part_lines)
+                    bar.update(task[2] - task[1])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        lines = np.concatenate(lines) if len(lines) > 0 else np.empty(0, dtype=np.int64)
+        rows = len(lines)
+        if rows > 0:
+            embedding = np.memmap(bin_path, dtype=np.float32, mode="r+", shape=(first_lines[-1] - 1, dimension))
+            # row k moves from row lines[k]-1 >= k, so copying chunks in order never overwrites unread rows
+            for start in range(0, rows, 100000):
+                chunk = lines[start:start+100000]
+                embedding[start:start+len(chunk)] = embedding[chunk - 1]
+            embedding.flush()
+            del embedding
+        with open(bin_path, "r+b") as f:
+            f.truncate(rows * dimension * 4)
+        with open(os.path.join(path, "words.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(words))
+        np.save(os.path.join(path, "lines.npy"), lines)
+        # meta.json is written last, a store without it is incomplete
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"rows": rows, "dimension": dimension, "source": WordEmbeddingStore.source(embedding_path)}, f)
+        return WordEmbeddingStore.load(path)
+
+    @staticmethod
+    def load(path: str) -> WordEmbeddingStore:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        store = WordEmbeddingStore()
+        store.path = path
+        store.dimension = meta["dimension"]
+        if meta["rows"] > 0:
+            store.embedding = np.memmap(os.path.join(path, "embedding.bin"), dtype=np.float32, mode="r",
+                                        shape=(meta["rows"], store.dimension))
+        else:
+            store.embedding = np.empty([0, store.dimension], dtype=np.float32)
+        with open(os.path.join(path, "words.txt"), encoding="utf-8") as f:
+            store.words = f.read().split("\n") if meta["rows"] > 0 else []
+        store.lines = np.load(os.path.join(path, "lines.npy"))
+        return store
+
+    def get_index(self, max_scan_num: int = -1) -> Dict[str, int]:
+        """map words to rows, only rows from the first max_scan_num lines of the text file are used
+
+        Args:
+            max_scan_num (int, optional): maximum line, -1 for all lines. Defaults to -1.
+
+        Returns:
+            Dict[str, int]: word to row, later rows win as in WordEmbedding
+        """
+        rows = len(self.words)
+        if max_scan_num >= 0:
+            rows = int(np.searchsorted(self.lines, max_scan_num))
+        return {word: row for row, word in enumerate(self.words[:rows])}
+
+    def gather(self, words: List[str], max_scan_num: int = -1) -> Tuple[np.ndarray, np.ndarray]:
+        """gather the embedding rows of words with one fancy index
+
+        Args:
+            words (List[str]): words
+            max_scan_num (int, optional): maximum line, -1 for all lines. Defaults to -1.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: embedding [len(words), dimension] and found mask [len(words)]
+        """
+        index = self.get_index(max_scan_num)
+        rows = np.asarray([index.get(word, -1) for word in words], dtype=np.int64)
+        found = rows >= 0
+        embedding = np.zeros([len(words), self.dimension], dtype=np.float32)
+        embedding[found] = self.embedding[rows[found]]
+        return embedding, found
+
+
+def _count_embedding_lines(task: Tuple[str, int, int, str]) -> int:
+    file, start, end, _ = task
+    with open(file, "rb") as f:
+        f.seek(start)
+        block = f.read(end - start)
+    return block.count(b"\n") + (0 if block.endswith(b"\n") else 1)
+
+
+def _parse_embedding_range(task: Tuple[str, int, int, str, int, int, str]) -> Tuple[List[str], np.ndarray, List[str]]:
+    file, start, end, encoding, first_line, dimension, bin_path = task
+    with open(file, "rb") as f:
+        f.seek(start)
+        block = f.read(end - start)
+    rows = block.split(b"\n")
+    if block.endswith(b"\n"):
+        rows.pop()
+    words, lines, values, fields, messages = [], [], [], [], []
+    for index, line in enumerate(rows):
+        line = str(line, encoding=encoding)
+        line = line.strip().split()
+        if len(line) == dimension+1:
+            words.append(line[0])
+        elif len(line) > dimension+1:
+            messages.append(f"{line} length more than {dimension+1}")
+            words.append(" ".join(line[:-dimension]))
+        else:
+            messages.append(f"{line} embedding error")
+            continue
+        lines.append(first_line + index)
+        values.append(" ".join(line[-dimension:]))
+        fields.append(line)
+    parsed = _parse_values(values, dimension)
+    if parsed is None:
+        # a value is not a number, find the malformed rows and drop them
+        keep = []
+        for row, value in enumerate(values):
+            try:
+                np.array(value.split(), dtype=np.float32)
+                keep.append(row)
+            except ValueError:
+                messages.append(f"{fields[row]} embedding error")
+        words = [words[row] for row in keep]
+        lines = [lines[row] for row in keep]
+        values = [values[row] for row in keep]
+        parsed = _parse_values(values, dimension)
+    lines = np.asarray(lines, dtype=np.int64)
+    if len(lines) > 0:
+        embedding = np.memmap(bin_path, dtype=np.float32, mode="r+", offset=(first_line - 1) * dimension * 4,
+                              shape=(int(lines[-1]) - first_line + 1, dimension))
+        embedding[lines - first_line] = parsed
+        embedding.flush()
+    return words, lines, messages
+
+
+def _parse_values(values: List[str], dimension: int) -> np.ndarray:
+    # None if a value is not a number, np.fromstring stops there or raises depending on the numpy version
+    if len(values) == 0:
+        return np.empty([0, dimension], dtype=np.float32)
+    try:
+        parsed = np.fromstring(" ".join(values), dtype=np.float32, sep=" ")
+    except ValueError:
+        return None
+    return parsed.reshape(-1, dimension) if parsed.size == len(values) * dimension else None
+
+
 class VocabEmbedding():
-    def __init__(self, vocab: Vocab):
+    def __init__(self, vocab: Vocab, dtype: str = "float32"):
+        """
+        Args:
+            vocab (Vocab): vocab
+            dtype (str, optional): embedding dtype of the model, float32, float16 or int8.
+                int8 tables are quantized by the model, the matrix is kept in float32. Defaults to "float32".
+        """
         self.vocab: Vocab = vocab
         self.dimension: int = 200
+        self.dtype = np.float16 if dtype == "float16" else np.float32
 
     def build_from_file(self,
                         embedding_path: str,
                         max_scan_num: int = 1000000,
-                        add_seg_vocab: bool = False):
+                        add_seg_vocab: bool = False,
+                        store_path: str = None,
+                        num_processes: int = 1):
+        """build the embedding matrix of vocab, words not in the embedding file are random
+
+        Args:
+            embedding_path (str): text embedding file
+            max_scan_num (int, optional): maximum line. Defaults to 1000000.
+            add_seg_vocab (bool, optional): scan all lines. Defaults to False.
+            store_path (str, optional): directory of the binary store converted from embedding_path,
+                converted on first use. Defaults to None.
+            num_processes (int, optional): processes parsing embedding_path into the store. Defaults to 1.
+
+        Returns:
+            VocabEmbedding: self
+        """
+        if store_path is not None:
+            return self.build_from_store(embedding_path, store_path, max_scan_num, add_seg_vocab, num_processes)
         embedding_index = {}
         if embedding_path is not None:
             embedding_index, self.dimension, embedding_reader = WordEmbedding() \
                 .build_from_txt(embedding_path,max_scan_num=max_scan_num,add_seg_vocab=add_seg_vocab).get_embedding()
-        self.embedding = np.empty([self.vocab.size, self.dimension])
+        self.embedding = np.empty([self.vocab.size, self.dimension], dtype=self.dtype)
         if embedding_reader is not None:
-            for idx, word in tqdm(enumerate(self.vocab.idx2item),
-                                  desc="load vocab embedding"):
-                if word in embedding_index:
-                    line = embedding_reader.line(embedding_index[word])
-                    line = line.strip().split()
-                    np_embedding = np.empty(self.dimension)
-                    np_embedding = line[-self.dimension:]
-                    self.embedding[idx, :] = np_embedding
-                else:
+            found = [idx for idx, word in enumerate(self.vocab.idx2item) if word in embedding_index]
+            with tqdm(total=len(found), desc="load vocab embedding") as bar:
+                for start in range(0, len(found), 4096):
+                    rows = found[start:start+4096]
+                    lines = embedding_reader.lines([embedding_index[self.vocab.idx2item[idx]] for idx in rows])
+                    for idx, line in zip(rows, lines):
+                        self.embedding[idx, :] = line.strip().split()[-self.dimension:]
+                    bar.update(len(rows))
+            found = set(found)
+            for idx in range(self.vocab.size):
+                if idx not in found:
                     self.embedding[idx, :] = self.random_embedding()
         return self
 
+    def build_from_store(self,
+                         embedding_path: str,
+                         store_path: str,
+                         max_scan_num: int = 1000000,
+                         add_seg_vocab: bool = False,
+                         num_processes: int = 1):
+        # a store converted from another file or an older version of it is converted again
+        if WordEmbeddingStore.exists(store_path, embedding_path):
+            store = WordEmbeddingStore.load(store_path)
+        else:
+            store = WordEmbeddingStore.convert_from_txt(embedding_path, store_path, num_processes)
+        self.dimension = store.dimension
+        if add_seg_vocab:
+            max_scan_num = -1
+        embedding, found = store.gather(self.vocab.idx2item, max_scan_num)
+        self.embedding = embedding.astype(self.dtype)
+        scale = np.sqrt(3.0 / self.dimension)
+        self.embedding[~found] = np.random.uniform(-scale, scale, (int((~found).sum()), self.dimension))
+        return self
+
     def random_embedding(self) -> np.numarray:
         scale = np.sqrt(3.0 / self.dimension)
         return np.random.uniform(-scale, scale, (1, self.dimension))
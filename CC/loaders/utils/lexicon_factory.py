@@ -1,11 +1,43 @@
-from typing import List
+from typing import Generator, List, Set, Tuple
 from . import *
 from tqdm import *
+import multiprocessing
 import json
+import math
 
 
 class TrieFactory():
 
+    @staticmethod
+    def iter_vocabs_from_files(vocab_files: List[str], max_line: int = -1) -> Generator[str, None, None]:
+        """stream the first column of vocab files
+
+        Args:
+            vocab_files (List[str]): list of files
+            max_line (int, optional): maximum line. Defaults to None.
+
+        Yields:
+            Generator[str]: word
+        """
+        for file in vocab_files:
+            for line in FileReader(file).block_line_iter(max_line):
+                line = line.split()
+                if line:
+                    yield line[0]
+
+    @staticmethod
+    def get_vocabs_from_files(vocab_files: List[str], max_line: int = -1) -> Set[str]:
+        """read the first column of vocab files
+
+        Args:
+            vocab_files (List[str]): list of files
+            max_line (int, optional): maximum line. Defaults to None.
+
+        Returns:
+            Set[str]: words
+        """
+        return set(TrieFactory.iter_vocabs_from_files(vocab_files, max_line))
+
     @staticmethod
     def get_trie_from_vocabs(vocab_files: List[str], max_line: int = -1) -> Trie:
         """build lexicon trie from vocab file
@@ -17,33 +49,47 @@ class TrieFactory():
         Returns:
             Trie: builded trie
         """
-        vocabs = set()
-        for file in vocab_files:
-            reader = FileReader(file)
-            file_lines = reader.line_size()
-            if max_line != -1:
-                file_lines = min(max_line, file_lines)
-            for index in tqdm(range(file_lines), desc="load vocabs into trie", total=file_lines):
-                line = reader.line(index)
-                line = line.strip().split()
-                word = line[0].strip()
-                vocabs.add(word)
         lexicon_tree: Trie = Trie()
-        for word in tqdm(vocabs, desc="build trie"):
+        for word in TrieFactory.iter_vocabs_from_files(vocab_files, max_line):
             lexicon_tree.insert(word)
         return lexicon_tree
 
     @staticmethod
-    def get_all_matched_word_from_dataset(dataset_files: List[str], lexicon_tree: Trie) -> List[str]:
+    def get_double_array_trie_from_vocabs(vocab_files: List[str], max_line: int = -1, cache_dir: str = None) -> DoubleArrayTrie:
+        """build double array lexicon trie from vocab file, the trie is saved in cache_dir once 
+        and memory-mapped afterwards
+
+        Args:
+            vocab_files (List[str]): list of files
+            max_line (int, optional): maximum line. Defaults to None.
+            cache_dir (str, optional): directory of the saved trie. Defaults to None.
+
+        Returns:
+            DoubleArrayTrie: builded trie
+        """
+        if cache_dir is not None and DoubleArrayTrie.exists(cache_dir):
+            return DoubleArrayTrie.load(cache_dir)
+        lexicon_tree = DoubleArrayTrie.from_words(
+            TrieFactory.get_vocabs_from_files(vocab_files, max_line))
+        if cache_dir is not None:
+            lexicon_tree.save(cache_dir)
+            return DoubleArrayTrie.load(cache_dir)
+        return lexicon_tree
+
+    @staticmethod
+    def get_all_matched_word_from_dataset(dataset_files: List[str], lexicon_tree: Trie, num_processes: int = 1) -> List[str]:
         """Get All Matched word from dataset json file
 
         Args:
             dataset_files (List[str]): dataset json file path, a json object each line
             lexicon_tree (Trie): lexicon trie
+            num_processes (int, optional): match shards of the files in a process pool when greater than 1. Defaults to 1.
 
         Returns:
             List[str]: all matched words are sorted in order
         """
+        if num_processes > 1:
+            return TrieFactory._get_all_matched_word_parallel(dataset_files, lexicon_tree, num_processes)
         matched_words = set()
         for file in dataset_files:
             reader = FileReader(file)
@@ -56,3 +102,76 @@ class TrieFactory():
                 for word in lexicon_tree.getAllMatchedWords(sent):
                     matched_words.add(word)
         return sorted(matched_words)
+
+    @staticmethod
+    def get_file_shards(file: str, num_shards: int, encoding: str = "utf-8") -> List[Tuple[str, int, int, str]]:
+        """split a file into byte ranges on line boundaries
+
+        Args:
+            file (str): file path
+            num_shards (int): the number of shards
+            encoding (str, optional): file encoding. Defaults to "utf-8".
+
+        Returns:
+            List[Tuple[str, int, int, str]]: (file, start, end, encoding) of each shard, end is exclusive
+        """
+        reader = FileReader(file, encoding=encoding)
+        lines = reader.get_line_mapper()
+        step = max(1, math.ceil(len(lines) / num_shards))
+        shards = []
+        for index in range(0, len(lines), step):
+            end = lines[index+step] if index + step < len(lines) else reader.size()
+            if end > lines[index]:
+                shards.append((file, lines[index], end, encoding))
+        return shards
+
+    @staticmethod
+    def _get_all_matched_word_parallel(dataset_files: List[str], lexicon_tree: Trie, num_processes: int) -> List[str]:
+        global _shared_lexicon_tree
+        shards = []
+        for file in dataset_files:
+            shards += TrieFactory.get_file_shards(file, num_processes * 4)
+        # forked workers share the parent's trie pages, otherwise the trie is sent once per worker
+        if "fork" in multiprocessing.get_all_start_methods():
+            # compile the automaton before forking, it is built lazily and not pickled
+            lexicon_tree.automaton
+            _shared_lexicon_tree = lexicon_tree
+            pool = multiprocessing.get_context("fork").Pool(num_processes)
+        else:
+            pool = multiprocessing.Pool(num_processes, initializer=_init_match_worker,
+                                        initargs=(lexicon_tree,))
+        matched_words = set()
+        try:
+            for words in tqdm(pool.imap_unordered(_match_shard, shards),
+                              desc="load dataset matched word", total=len(shards)):
+                matched_words |= words
+        finally:
+            pool.close()
+            pool.join()
+            _shared_lexicon_tree = None
+        return sorted(matched_words)
+
+
+_shared_lexicon_tree: Trie = None
+
+
+def _init_match_worker(lexicon_tree: Trie):
+    global _shared_lexicon_tree
+    _shared_lexicon_tree = lexicon_tree
+
+
+def _match_shard(shard: Tuple[str, int, int, str]) -> Set[str]:
+    file, start, end, encoding = shard
+    with open(file, "rb") as f:
+        f.seek(start)
+        block = f.read(end - start)
+    matched_words = set()
+    for line in block.split(b"\n"):
+        line = line.strip()
+        if not line:
+            continue
+        data = json.loads(line.decode(encoding))
+        assert 'text' in data, 'dataset type error, expected text property in object'
+        sent = [ch for ch in data['text']]
+        matched_words.update(_shared_lexicon_tree.getAllMatchedWords(sent))
+    return matched_words
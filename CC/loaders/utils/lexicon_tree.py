@@ -1,5 +1,6 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 from typing import Dict, List
+import numpy as np
 
 
 class TrieNode():
@@ -11,6 +12,107 @@ class TrieNode():
         self.is_word = False
 
 
+class AhoCorasick():
+    """Aho-Corasick automaton compiled from a Trie, states are numbered in BFS order
+    """
+
+    def __init__(self, trie):
+        """compile the automaton
+
+        Args:
+            trie (Trie): the lexicon trie
+        """
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.depth: List[int] = [0]
+        # the nearest word state on the fail chain (itself included), -1 if none
+        self.output: List[int] = [-1]
+        queue = deque([(trie.root, 0)])
+        while queue:
+            node, state = queue.popleft()
+            for letter, child in node.children.items():
+                next_state = len(self.goto)
+                self.goto[state][letter] = next_state
+                self.goto.append({})
+                self.depth.append(self.depth[state] + 1)
+                if state == 0:
+                    fail = 0
+                else:
+                    fail = self.fail[state]
+                    while fail != 0 and letter not in self.goto[fail]:
+                        fail = self.fail[fail]
+                    fail = self.goto[fail].get(letter, 0)
+                self.fail.append(fail)
+                if child.is_word and self.depth[next_state] > trie.min_len:
+                    self.output.append(next_state)
+                else:
+                    self.output.append(self.output[fail])
+                queue.append((child, next_state))
+        self.word_ids: List[int] = None
+
+    def state(self, word: str) -> int:
+        """the state reached by word, -1 if there is none
+
+        Args:
+            word (str): the word
+
+        Returns:
+            int: state
+        """
+        state = 0
+        for letter in word:
+            state = self.goto[state].get(letter)
+            if state is None:
+                return -1
+        return state
+
+    def set_word_ids(self, vocab):
+        """store the vocab id of every word state, words missing in vocab get the unk id of their length
+
+        Args:
+            vocab (Vocab): word vocab
+        """
+        unk_ids = [vocab.unk_id(length) for length in range(max(self.depth) + 1)]
+        self.word_ids = [unk_ids[depth] if self.output[state] == state else -1
+                         for state, depth in enumerate(self.depth)]
+        for word, idx in vocab.item2idx.items():
+            state = self.state(word)
+            if state > 0 and self.output[state] == state:
+                self.word_ids[state] = idx
+        return self
+
+    def match(self, sent: str, with_ids: bool = False) -> List[List[int]]:
+        """scan sent once from left to right
+
+        Args:
+            sent (str): the sent, a string or a list of tokens
+            with_ids (bool, optional): return (length, word_id) instead of length. Defaults to False.
+
+        Returns:
+            List[List[int]]: the lengths of the words starting at each position, in ascending order
+        """
+        goto, fail, depth, output = self.goto, self.fail, self.depth, self.output
+        word_ids = self.word_ids if with_ids else None
+        matched: List[List[int]] = [[] for _ in range(len(sent))]
+        state = 0
+        for end, letter in enumerate(sent):
+            while True:
+                next_state = goto[state].get(letter)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            word_state = output[state]
+            while word_state > 0:
+                length = depth[word_state]
+                matched[end - length + 1].append(
+                    length if word_ids is None else (length, word_ids[word_state]))
+                word_state = output[fail[word_state]]
+        return matched
+
+
 class Trie():
     """Trie
     """
@@ -23,6 +125,9 @@ class Trie():
         """
         self.root: TrieNode = TrieNode()
         self.max_depth: int = 0
+        self._automaton: AhoCorasick = None
+        # word_vocab whose ids are returned by getAllMatchedSpans, see set_word_ids
+        self.word_vocab = None
         if use_single:
             self.min_len: int = 0
         else:
@@ -40,6 +145,7 @@ class Trie():
             ptr = ptr.children[letter]
             deep += 1
         ptr.is_word = True
+        self._automaton = None
         if deep > self.max_depth:
             self.max_depth = deep
         return self
@@ -55,6 +161,38 @@ class Trie():
         """
         return self.insert(word)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_automaton", None)
+        return state
+
+    @property
+    def automaton(self) -> AhoCorasick:
+        """the Aho-Corasick automaton, compiled on first use and dropped on insert
+
+        Returns:
+            AhoCorasick: automaton
+        """
+        if getattr(self, "_automaton", None) is None:
+            self._automaton = AhoCorasick(self)
+            if getattr(self, "word_vocab", None) is not None:
+                self._automaton.set_word_ids(self.word_vocab)
+        return self._automaton
+
+    def set_word_ids(self, vocab):
+        """store the word_vocab id of each word in its terminal state, 
+        words missing in vocab get the same unk id as vocab.token2id
+
+        Args:
+            vocab (Vocab): word vocab
+
+        Returns:
+            Trie: self
+        """
+        self.word_vocab = vocab
+        self.automaton.set_word_ids(vocab)
+        return self
+
     def search(self, word: str) -> bool:
         """search word 
 
@@ -95,6 +233,26 @@ class Trie():
             matched = matched[1:]
         return matched
 
+    def enumerateAllMatch(self, sent: str, space: str = "") -> List[List[str]]:
+        """enumerate words starting with each position of sent in a single pass, 
+        same as calling enumerateMatch(sent[i:]) for every i
+
+        Args:
+            sent (str): the sent
+            space (str, optional): spilt string. Defaults to "".
+
+        Returns:
+            List[List[str]]: the words starting with sent[i]
+        """
+        all_matched: List[List[str]] = []
+        for start, lengths in enumerate(self.automaton.match(sent)):
+            matched = [space.join(sent[start:start+length])
+                       for length in lengths]
+            if len(matched) > 1 and len(matched[0]) == 1:
+                matched = matched[1:]
+            all_matched.append(matched)
+        return all_matched
+
     def getAllMatchedWords(self, sent: str) -> List[str]:
         """Get All Matched Words
 
@@ -105,17 +263,13 @@ class Trie():
             List[str]: list of words 
         """
         matched_set = set()
-        for i in range(len(sent)):
-            sub_sent = sent[i:]
-            for word in self.enumerateMatch(sub_sent):
-                matched_set.add(word)
+        for words in self.enumerateAllMatch(sent):
+            matched_set.update(words)
         return sorted(matched_set)
 
     def getAllMatchedWordList(self, sent: str, max_words: None) -> List[List[str]]:
         matched: List[List[str]] = [[] for i in range(len(sent))]
-        for i in range(len(sent)):
-            sub_sent = sent[i:]
-            words = self.enumerateMatch(sub_sent)
+        for i, words in enumerate(self.enumerateAllMatch(sent)):
             if max_words is not None:
                 words = words[:max_words]
             for word in words:
@@ -127,3 +281,55 @@ class Trie():
             if max_words is not None:
                 matched[i] = matched[i][:max_words]
         return matched
+
+    def getAllMatchedSpans(self, sent: str, max_words: int = None) -> np.ndarray:
+        """Get All Matched words as spans, in the same order as enumerateMatch(sent[i:]) for every i
+
+        Args:
+            sent (str): to match sentence
+            max_words (int, optional): keep the first max_words words of each start. Defaults to None.
+
+        Returns:
+            np.ndarray: [N, 3] int array of (start, end, word_id), end is exclusive
+        """
+        if getattr(self, "word_vocab", None) is None:
+            raise ValueError("word ids are not set, call set_word_ids first")
+        spans = []
+        for start, matched in enumerate(self.automaton.match(sent, with_ids=True)):
+            if len(matched) > 1 and matched[0][0] == 1:
+                matched = matched[1:]
+            if max_words is not None:
+                matched = matched[:max_words]
+            spans.extend((start, start+length, word_id)
+                         for length, word_id in matched)
+        return np.array(spans, dtype=np.int64).reshape(-1, 3)
+
+    def getAllMatchedLattice(self, sent: str, max_words: int = None) -> np.ndarray:
+        """same as getAllMatchedWordList, but returns word ids instead of strings
+
+        Args:
+            sent (str): to match sentence
+            max_words (int, optional): maximum words of each position. Defaults to None.
+
+        Returns:
+            np.ndarray: [N, 5] int array of (position, slot, start, end, word_id), 
+                the word of getAllMatchedWordList(sent)[position][slot]
+        """
+        spans = self.getAllMatchedSpans(sent, max_words).tolist()
+        matched: List[List[List[int]]] = [[] for i in range(len(sent))]
+        k = 0
+        for i in range(len(sent)):
+            while k < len(spans) and spans[k][0] == i:
+                span = spans[k]
+                for j in range(i+1, span[1]):
+                    matched[j].append(span)
+                k += 1
+                if len(matched[i]) > 0 and span[1] - span[0] == 1:
+                    continue
+                matched[i].append(span)
+            if max_words is not None:
+                matched[i] = matched[i][:max_words]
+        lattice = [(i, slot, start, end, word_id)
+                   for i, words in enumerate(matched)
+                   for slot, (start, end, word_id) in enumerate(words)]
+        return np.array(lattice, dtype=np.int64).reshape(-1, 5)
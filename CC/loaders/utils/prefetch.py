@@ -0,0 +1,142 @@
+from typing import Any, Dict, Iterator, List
+import threading
+from torch.utils.data import Dataset, Sampler
+
+
+class PrefetchDataset(Dataset):
+    """map-style dataset whose samples are loaded ahead of use, for samples read from disk.
+
+    worker threads load the samples in the order scheduled by PrefetchSampler, at most depth samples
+    ahead of the last one taken, and __getitem__ takes them from the queue. an index outside the
+    look-ahead window is loaded directly. meant for DataLoader with num_workers=0, the threads
+    live in the process calling __getitem__.
+    """
+
+    def __init__(self, dataset: Dataset, depth: int = 64, num_threads: int = 2):
+        """
+        Args:
+            dataset (Dataset): map-style dataset
+            depth (int, optional): maximum samples loaded ahead. Defaults to 64.
+            num_threads (int, optional): loading threads. Defaults to 2.
+        """
+        self.dataset: Dataset = dataset
+        self.depth: int = depth
+        self.num_threads: int = num_threads
+        self.hits: int = 0
+        self.misses: int = 0
+        self._condition = threading.Condition()
+        self._order: List[int] = []
+        # samples by position in the order, positions below _cursor are consumed
+        self._ready: Dict[int, Any] = {}
+        self._next: int = 0
+        self._cursor: int = 0
+        self._waiting: int = None
+        self._generation: int = 0
+        self._closed: bool = False
+        self._threads: List[threading.Thread] = []
+
+    def schedule(self, order: List[int]):
+        """start loading the indexes of order, the samples of a previous order are dropped"""
+        with self._condition:
+            self._generation += 1
+            self._order = list(order)
+            self._ready = {}
+            self._next = 0
+            self._cursor = 0
+            self._closed = False
+            self._condition.notify_all()
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.num_threads:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._ready = {}
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "ready": len(self._ready)}
+
+    def _work(self):
+        while True:
+            with self._condition:
+                # backpressure, wait while depth samples are loaded or loading ahead of the cursor
+                while not self._closed and (self._next >= len(self._order) or self._next - self._cursor >= self.depth):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                position, generation = self._next, self._generation
+                index = self._order[position]
+                self._next += 1
+            try:
+                sample = self.dataset[index]
+            except Exception:
+                # loaded again by __getitem__, which raises the error
+                sample = _FAILED
+            with self._condition:
+                if generation == self._generation and (position >= self._cursor or position == self._waiting):
+                    self._ready[position] = sample
+                    self._condition.notify_all()
+
+    def _take(self, index: int) -> int:
+        # position of index in the look-ahead window, the samples skipped before it are dropped
+        end = min(self._cursor + self.depth, len(self._order))
+        for position in range(self._cursor, end):
+            if self._order[position] == index:
+                for skipped in range(self._cursor, position):
+                    self._ready.pop(skipped, None)
+                self._cursor = position + 1
+                self._condition.notify_all()
+                return position
+        return None
+
+    def __getitem__(self, index: int) -> Any:
+        with self._condition:
+            position = self._take(index)
+            if position is not None and position in self._ready:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if position is not None and position < self._next:
+                    # a worker is loading it
+                    self._waiting = position
+                    while position not in self._ready and not self._closed:
+                        self._condition.wait()
+                    self._waiting = None
+                elif position is not None:
+                    self._next = position + 1
+            sample = self._ready.pop(position, _FAILED)
+        return self.dataset[index] if sample is _FAILED else sample
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+
+_FAILED = object()
+
+
+class PrefetchSampler(Sampler):
+    """sampler or batch sampler passing the order of every epoch to a PrefetchDataset"""
+
+    def __init__(self, sampler: Sampler, dataset: PrefetchDataset):
+        self.sampler: Sampler = sampler
+        self.dataset: PrefetchDataset = dataset
+
+    def set_epoch(self, epoch: int):
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self) -> Iterator[Any]:
+        order = list(self.sampler)
+        self.dataset.schedule([index for item in order
+                               for index in (item if isinstance(item, (list, tuple)) else [item])])
+        return iter(order)
+
+    def __len__(self) -> int:
+        return len(self.sampler)
@@ -1,21 +1,68 @@
+from collections import OrderedDict
 from hashlib import md5
 import os
 import math
+import mmap
 from itertools import takewhile, repeat
 from functools import lru_cache
-from typing import Generator, List
+from typing import Generator, List, Tuple, Union
 from tqdm import tqdm
+import numpy as np
 import json
 
+# header of the .idx sidecar: version, file size, mtime_ns, etag part count, etag md5 as two int64
+_INDEX_VERSION = 1
+_INDEX_HEADER = 6
+_ETAG_BUFFER_SIZE = 5*1024*1024
+
 
 class FileReader():
     """File reader for fast coding
     """
-    def __init__(self, file_name, encoding="utf-8", line_mapper=None):
+    def __init__(self, file_name, encoding="utf-8", line_mapper=None, cache_size: int = 1024):
+        """
+        Args:
+            file_name (str): file path
+            encoding (str, optional): file encoding. Defaults to "utf-8".
+            line_mapper (optional): row offsets, a list or an int64 array, built or loaded from the .idx sidecar if None. Defaults to None.
+            cache_size (int, optional): decoded rows kept by line(), 0 to disable. Defaults to 1024.
+        """
         self.file_name = file_name
         self.encoding = encoding
-        self._line_mapper = line_mapper
+        self.cache_size = cache_size
+        self._line_mapper = np.asarray(line_mapper, dtype=np.int64) if line_mapper is not None else None
         self._size = None
+        self._etag = None
+        self._mmap = None
+        self._line_cache = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_mmap"] = None
+        state["_line_cache"] = OrderedDict()
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """release the memory map, memoryviews returned with raw=True must be released first"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._line_cache.clear()
+
+    def _view(self) -> memoryview:
+        # one read-only map for the lifetime of the reader
+        if self._mmap is None:
+            if self.size() == 0:
+                return memoryview(b"")
+            with open(self.file_name, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
 
     @lru_cache()
     def __repr__(self) -> str:
@@ -29,8 +76,9 @@ class FileReader():
         return json.dumps(attr, indent=4, ensure_ascii=False)
 
     @lru_cache()
-    def etag(self, buffer_size: int = 5*1024*1024) -> str:
-        """get S3 etag: {md5_checksum}-{part_count}
+    def etag(self, buffer_size: int = _ETAG_BUFFER_SIZE) -> str:
+        """get S3 etag: {md5_checksum}-{part_count}, the etag of the default buffer size
+        is kept in the .idx sidecar
 
         Args:
             buffer_size (int, optional): buffer size for reading. Defaults to 5*1024*1024.
@@ -38,6 +86,10 @@ class FileReader():
         Returns:
             str: s3 etag 
         """
+        if buffer_size == _ETAG_BUFFER_SIZE:
+            self.get_line_mapper()
+            if self._etag is not None:
+                return self._etag
         size = self.size()
         md5sum = b""
         parts = math.ceil(size/buffer_size)
@@ -46,30 +98,42 @@ class FileReader():
             for block in it:
                 md5sum += md5(block).digest()
                 bar.update(len(block))
+        return FileReader._format_etag(md5(md5sum).digest(), parts)
+
+    def fingerprint(self, block_size: int = 64*1024, blocks: int = 16) -> str:
+        """fast fingerprint: size, mtime and inode with the md5 of the head, the tail and
+        blocks evenly spaced in between, reads at most (blocks + 2) * block_size bytes
+
+        Args:
+            block_size (int, optional): bytes of each sampled block. Defaults to 64*1024.
+            blocks (int, optional): strided blocks between head and tail. Defaults to 16.
+
+        Returns:
+            str: fingerprint
+        """
+        stat = os.stat(self.file_name)
+        size = stat.st_size
+        digest = md5(f"{size}:{stat.st_mtime_ns}:{stat.st_ino}".encode("utf-8"))
+        starts = {0, max(0, size - block_size)} | {size * i // (blocks + 1) for i in range(1, blocks + 1)}
+        with open(self.file_name, "rb") as f:
+            for start in sorted(starts):
+                f.seek(start)
+                digest.update(f.read(block_size))
+        return f"fast-{digest.hexdigest()}"
+
+    @staticmethod
+    def _format_etag(digest: bytes, parts: int) -> str:
         if parts <= 1:
-            return md5(md5sum).hexdigest()
-        return f"{md5(md5sum).hexdigest()}-{parts}"
+            return digest.hex()
+        return f"{digest.hex()}-{parts}"
 
-    @lru_cache()
     def line_size(self) -> int:
-        """get the numbers of rows
+        """get the numbers of rows, a trailing newline counts as an empty last row
 
         Returns:
             int: rows count
         """
-        if hasattr(self, "_line_size"):
-            return self._line_size
-        buffer_size = 1024*1024
-        with open(self.file_name, "rb") as file:
-            it = takewhile(lambda x: x, (file.read(buffer_size)
-                           for _ in repeat(None)))
-            with tqdm(desc=f"count line size {self.file_name}",
-                      unit="L") as bar:
-                for block in it:
-                    bar.update(block.count(b'\n'))
-                if block[-1] != b'\n':
-                    bar.update(1)
-                return bar.n
+        return len(self.get_line_mapper())
 
     def line_iter(self) -> Generator[str,None,None]:
         """get row iterator, same as TextIOWrapper
@@ -81,6 +145,33 @@ class FileReader():
             for l in f:
                 yield l
 
+    def block_line_iter(self, max_lines: int = -1, skip: int = 0, buffer_size: int = 5*1024*1024) -> Generator[str, None, None]:
+        """get row iterator in a single sequential pass of large blocks
+
+        Args:
+            max_lines (int, optional): stop before this row index, -1 for all rows. Defaults to -1.
+            skip (int, optional): the number of leading rows to skip. Defaults to 0.
+            buffer_size (int, optional): buffer size for reading. Defaults to 5*1024*1024.
+
+        Yields:
+            Generator[str]: line without the trailing newline
+        """
+        index = 0
+        rest = b""
+        with tqdm(total=self.size(), desc=f"read {self.file_name}", unit="B", unit_scale=True, unit_divisor=1024) as bar:
+            for block in self.iter(buffer_size=buffer_size):
+                bar.update(len(block))
+                rows = (rest + block).split(b'\n')
+                rest = rows.pop()
+                for row in rows:
+                    if index == max_lines:
+                        return
+                    if index >= skip:
+                        yield str(row, encoding=self.encoding)
+                    index += 1
+            if rest and index != max_lines and index >= skip:
+                yield str(rest, encoding=self.encoding)
+
     def iter(self, buffer_size=5*1024*1024) -> Generator[bytes,None,None]:
         """get binary iterator, same as FileIO
 
@@ -92,6 +183,30 @@ class FileReader():
                                                  for _ in repeat(None))):
                 yield block
 
+    def byte_ranges(self, part_size: int, start: int = 0) -> List[Tuple[int, int]]:
+        """split the file into byte ranges of about part_size, each range ends at a line end
+
+        Args:
+            part_size (int): approximate bytes of each range
+            start (int, optional): offset of the first range, should be a line start. Defaults to 0.
+
+        Returns:
+            List[Tuple[int, int]]: (start, end) of each range, end is exclusive
+        """
+        size = self.size()
+        ranges = []
+        with open(self.file_name, "rb") as file:
+            while start < size:
+                end = start + max(1, part_size)
+                if end < size:
+                    file.seek(end - 1)
+                    file.readline()
+                    end = file.tell()
+                end = min(end, size)
+                ranges.append((start, end))
+                start = end
+        return ranges
+
     def __len__(self) -> int:
         """length
 
@@ -110,9 +225,8 @@ class FileReader():
             self._size = os.path.getsize(self.file_name)
         return self._size
 
-    @lru_cache(maxsize=100000)
     def line(self, index: int = 0) -> str:
-        """get the specific row
+        """get the specific row, the last cache_size rows are kept decoded
 
         Args:
             index (int, optional): row index. Defaults to 0.
@@ -123,43 +237,117 @@ class FileReader():
         Returns:
             str: the content of row
         """
+        if index in self._line_cache:
+            self._line_cache.move_to_end(index)
+            return self._line_cache[index]
         lines = self.get_line_mapper()
         if index >= len(lines):
             raise ValueError(f"index out of range")
-        length = self.size() - \
-            lines[index] if index == len(
-                lines)-1 else lines[index+1]-lines[index]
-        f = os.open(self.file_name, os.O_RDONLY)
-        binary = os.pread(f, length, lines[index])
-        os.close(f)
-        return str(binary, encoding=self.encoding)
+        start = int(lines[index])
+        end = self.size() if index == len(lines)-1 else int(lines[index+1])
+        line = str(self._view()[start:end], encoding=self.encoding)
+        if self.cache_size > 0:
+            self._line_cache[index] = line
+            if len(self._line_cache) > self.cache_size:
+                self._line_cache.popitem(last=False)
+        return line
+
+    def lines(self, indices: List[int], raw: bool = False) -> List[Union[str, memoryview]]:
+        """get rows by index, read from the memory map without the row cache
 
-    def get_line_mapper(self) -> List[str]:
-        """get row mapper
+        Args:
+            indices (List[int]): row indexes
+            raw (bool, optional): return memoryviews of the file instead of strings. Defaults to False.
+
+        Raises:
+            ValueError: index out of range
 
         Returns:
-            List[int]: the row mapper
+            List[Union[str, memoryview]]: rows
+        """
+        lines = self.get_line_mapper()
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= len(lines)):
+            raise ValueError(f"index out of range")
+        starts = np.asarray(lines[indices], dtype=np.int64)
+        following = indices + 1
+        ends = np.where(following < len(lines), lines[np.minimum(following, len(lines) - 1)], self.size()) \
+            if len(indices) > 0 else starts
+        return self._slice(starts.tolist(), ends.tolist(), raw)
+
+    def line_range(self, start: int, stop: int, raw: bool = False, batch_size: int = 65536) -> Generator[Union[str, memoryview], None, None]:
+        """iterate rows start to stop - 1 from the memory map
+
+        Args:
+            start (int): first row index
+            stop (int): row index to stop before, clipped to the row count
+            raw (bool, optional): yield memoryviews of the file instead of strings. Defaults to False.
+            batch_size (int, optional): rows sliced at once. Defaults to 65536.
+
+        Yields:
+            Generator[Union[str, memoryview]]: rows
+        """
+        lines = self.get_line_mapper()
+        stop = min(stop, len(lines))
+        for begin in range(start, stop, batch_size):
+            end = min(begin + batch_size, stop)
+            offsets = np.asarray(lines[begin:end + 1], dtype=np.int64).tolist()
+            if len(offsets) == end - begin:
+                offsets.append(self.size())
+            yield from self._slice(offsets[:-1], offsets[1:], raw)
+
+    def _slice(self, starts: List[int], ends: List[int], raw: bool) -> List[Union[str, memoryview]]:
+        view = self._view()
+        if raw:
+            return [view[start:end] for start, end in zip(starts, ends)]
+        return [str(view[start:end], encoding=self.encoding) for start, end in zip(starts, ends)]
+
+    def get_line_mapper(self) -> np.ndarray:
+        """get row mapper, the start offset of every row. it is saved as {file_name}.idx
+        and memory-mapped while the file keeps its size and mtime
+
+        Returns:
+            np.ndarray: the row mapper
         """
         if self._line_mapper is not None:
             return self._line_mapper
-        lines = []
-        buffer_size = 1024*1024
-        offset = 0
-        with open(self.file_name, "rb") as file:
-            it = takewhile(lambda x: x, (file.read(buffer_size)
-                           for _ in repeat(None)))
-            with tqdm(desc="build line mapper", unit="L") as bar:
-                for block in it:
-                    bar.update(block.count(b'\n'))
-                    b = block.split(b'\n')
-                    for i in b[:-1]:
-                        if offset == 0:
-                            lines.append(offset)
-                        offset += len(i)+1
-                        lines.append(offset)
-                    offset += len(b[-1])
-                if block[-1] != b'\n':
-                    bar.update(1)
-                self._line_size = bar.n
-        self._line_mapper = lines
-        return lines
+        path = f"{self.file_name}.idx"
+        stat = os.stat(self.file_name)
+        if os.path.exists(path):
+            index = np.memmap(path, dtype="<i8", mode="r")
+            header = index[:_INDEX_HEADER].tolist()
+            if len(header) == _INDEX_HEADER and header[:3] == [_INDEX_VERSION, stat.st_size, stat.st_mtime_ns]:
+                self._etag = FileReader._format_etag(index[4:6].tobytes(), header[3])
+                self._line_mapper = index[_INDEX_HEADER:]
+                return self._line_mapper
+        self._line_mapper = self._build_index(path, stat)
+        return self._line_mapper
+
+    def _build_index(self, path: str, stat: os.stat_result) -> np.ndarray:
+        # rows and etag in one pass
+        offsets = [np.zeros(1 if stat.st_size > 0 else 0, dtype=np.int64)]
+        md5sum = b""
+        position = 0
+        with tqdm(total=stat.st_size, desc=f"index {self.file_name}", unit="B", unit_scale=True, unit_divisor=1024) as bar:
+            for block in self.iter(buffer_size=_ETAG_BUFFER_SIZE):
+                md5sum += md5(block).digest()
+                offsets.append(np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10) + (position + 1))
+                position += len(block)
+                bar.update(len(block))
+        offsets = np.concatenate(offsets)
+        parts = math.ceil(position/_ETAG_BUFFER_SIZE)
+        digest = md5(md5sum).digest()
+        self._etag = FileReader._format_etag(digest, parts)
+        header = np.array([_INDEX_VERSION, stat.st_size, stat.st_mtime_ns, parts], dtype="<i8")
+        temp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "wb") as f:
+                f.write(header.tobytes())
+                f.write(digest)
+                f.write(offsets.astype("<i8").tobytes())
+            os.replace(temp, path)
+        except OSError:
+            # read-only directory, the index stays in memory
+            if os.path.exists(temp):
+                os.remove(temp)
+        return offsets
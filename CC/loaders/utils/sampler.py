@@ -0,0 +1,85 @@
+from typing import Iterator, List
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class BucketBatchSampler(Sampler):
+    """batch sampler grouping samples of similar length.
+
+    every epoch the samples are shuffled with seed + epoch, split into buckets of bucket_size batches,
+    sorted by length inside each bucket and cut into batches, then the batches are shuffled.
+    iterating the sampler moves it to the next epoch, set_epoch overrides it.
+    """
+
+    def __init__(self, lengths: List[int], batch_size: int, max_tokens: int = None, bucket_size: int = 100,
+                 shuffle: bool = True, seed: int = 0, drop_last: bool = False):
+        """
+        Args:
+            lengths (List[int]): length of each sample, e.g. attention_mask.sum(1)
+            batch_size (int): samples per batch, ignored if max_tokens is set
+            max_tokens (int, optional): maximum padded tokens (samples * longest length) per batch. Defaults to None.
+            bucket_size (int, optional): batches per bucket. Defaults to 100.
+            shuffle (bool, optional): shuffle samples and batches every epoch. Defaults to True.
+            seed (int, optional): random seed. Defaults to 0.
+            drop_last (bool, optional): drop the last batch of each bucket if it is smaller than batch_size. Defaults to False.
+        """
+        self.lengths: np.ndarray = np.asarray(lengths)
+        self.batch_size: int = batch_size
+        self.max_tokens: int = max_tokens
+        self.bucket_size: int = bucket_size
+        self.shuffle: bool = shuffle
+        self.seed: int = seed
+        self.drop_last: bool = drop_last
+        self.epoch: int = 0
+        self._batches: List[List[int]] = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self._batches = None
+
+    def batches(self) -> List[List[int]]:
+        """batches of the current epoch"""
+        if self._batches is not None:
+            return self._batches
+        rng = np.random.RandomState(self.seed + self.epoch)
+        order = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        if self.max_tokens is not None:
+            # a bucket holds about bucket_size batches of the mean length
+            mean_length = max(1, int(self.lengths.mean())) if len(self.lengths) > 0 else 1
+            bucket = max(1, self.bucket_size * self.max_tokens // mean_length)
+        else:
+            bucket = self.bucket_size * self.batch_size
+        batches = []
+        for start in range(0, len(order), bucket):
+            indexes = order[start:start+bucket]
+            indexes = indexes[np.argsort(self.lengths[indexes], kind="stable")]
+            batches += self._split(indexes.tolist())
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        self._batches = batches
+        return batches
+
+    def _split(self, indexes: List[int]) -> List[List[int]]:
+        if self.max_tokens is None:
+            batches = [indexes[i:i+self.batch_size] for i in range(0, len(indexes), self.batch_size)]
+            if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+                batches.pop()
+            return batches
+        # indexes are sorted by length, the last sample of a batch is the longest
+        batches, batch = [], []
+        for index in indexes:
+            if len(batch) > 0 and (len(batch) + 1) * int(self.lengths[index]) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self.batches()
+        self.set_epoch(self.epoch + 1)
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return len(self.batches())
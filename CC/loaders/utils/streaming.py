@@ -0,0 +1,74 @@
+from typing import Any, Callable, Iterator
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+from .reader import FileReader
+
+
+class StreamingDataset(IterableDataset):
+    """samples converted on the fly from a json lines file, memory does not grow with the file.
+
+    the file is split into byte ranges with FileReader.byte_ranges, DataLoader workers take every
+    num_workers-th range and convert its lines, so each line is read by exactly one worker.
+    with shuffle_buffer > 0 the ranges are shuffled every epoch and samples leave through a bounded
+    shuffle buffer. iterating moves to the next epoch, DataLoader workers only see the epoch set by
+    set_epoch unless persistent_workers is set.
+    """
+
+    def __init__(self, file: str, convert: Callable[[str], Any], part_size: int = 4*1024*1024,
+                 shuffle_buffer: int = 0, seed: int = 0, encoding: str = "utf-8"):
+        """
+        Args:
+            file (str): json lines dataset
+            convert (Callable[[str], Any]): line to sample, run in the DataLoader workers
+            part_size (int, optional): approximate bytes of each range. Defaults to 4*1024*1024.
+            shuffle_buffer (int, optional): samples held for shuffling, 0 keeps the file order. Defaults to 0.
+            seed (int, optional): random seed. Defaults to 0.
+            encoding (str, optional): file encoding. Defaults to "utf-8".
+        """
+        self.file: str = file
+        self.convert = convert
+        self.part_size: int = part_size
+        self.shuffle_buffer: int = shuffle_buffer
+        self.seed: int = seed
+        self.encoding: str = encoding
+        self.epoch: int = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[Any]:
+        ranges = FileReader(self.file, encoding=self.encoding).byte_ranges(self.part_size)
+        # every worker draws the same range order, then keeps its own share
+        rng = np.random.RandomState(self.seed + self.epoch)
+        if self.shuffle_buffer > 0:
+            ranges = [ranges[i] for i in rng.permutation(len(ranges))]
+        worker = get_worker_info()
+        if worker is not None:
+            ranges = ranges[worker.id::worker.num_workers]
+            rng = np.random.RandomState((self.seed + self.epoch) * worker.num_workers + worker.id)
+        self.epoch += 1
+        samples = (self.convert(line) for line in self._lines(ranges))
+        if self.shuffle_buffer <= 0:
+            return samples
+        return self._shuffle(samples, rng)
+
+    def _lines(self, ranges) -> Iterator[str]:
+        with open(self.file, "rb") as f:
+            for start, end in ranges:
+                f.seek(start)
+                for line in f.read(end - start).split(b"\n"):
+                    line = line.strip()
+                    if line:
+                        yield line.decode(self.encoding)
+
+    def _shuffle(self, samples: Iterator[Any], rng: np.random.RandomState) -> Iterator[Any]:
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            index = rng.randint(len(buffer))
+            yield buffer[index]
+            buffer[index] = sample
+        rng.shuffle(buffer)
+        yield from buffer
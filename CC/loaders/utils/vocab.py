@@ -1,6 +1,7 @@
 from typing import *
 from CC.loaders.utils import *
 from tqdm import *
+import numpy as np
 
 
 class Vocab():
@@ -41,25 +42,18 @@ class Vocab():
             is_word (bool, optional): is word. Defaults to False.
             has_default (bool, optional): has default value. Defaults to False.
             unk_num (str, optional): unkown number. Defaults to 0.
+            max_scan_num (int, optional): maximum line of each file, -1 for all lines. Defaults to -1.
+            skip (int, optional): the number of leading lines to skip. Defaults to 0.
 
         Returns:
             Vocab: self
         """
         words = []
         for file in files:
-            reader = FileReader(file)
-            file_lines = reader.line_size()
-            if max_scan_num != -1:
-                file_lines = min(max_scan_num, file_lines)
-            for index in tqdm(range(skip,file_lines), desc="load vocab from files"):
-                line = reader.line(index)
-                line = line.strip()
-                if not line:
-                    continue
-                if index >= file_lines:
-                    break
-                word = line.split()[0].strip()
-                words.append(word)
+            for line in FileReader(file).block_line_iter(max_scan_num, skip):
+                line = line.split()
+                if line:
+                    words.append(line[0])
         return self.from_list(words, is_word, has_default, unk_num)
 
     def id2token(self, id: int):
@@ -90,19 +84,92 @@ class Vocab():
             int or List[int]: turen List[int] if token is List[str]. otherwise return int
         """
         if isinstance(token, list):
+            if all(isinstance(t, str) for t in token):
+                return self.tokens2ids(token).tolist()
             return [self.token2id(t) for t in token]
         if token in self.item2idx:
             return self.item2idx[token]
         elif self.is_word:
-            unk = f'<unk>{len(token)}'
-            if unk in self.item2idx:
-                return self.item2idx[unk]
-            else:
-                return self.item2idx['<unk>']
+            return self.unk_id(len(token))
         else:
             print(f"token:{token} does not exist!")
             raise KeyError()
 
+    def tokens2ids(self, tokens: List[Any], dtype=np.int64) -> np.ndarray:
+        """ convert tokens to ids in one pass
+
+        Args:
+            tokens (List[Any]): token list, or list of token lists of the same length
+            dtype (optional): dtype of the ids. Defaults to np.int64.
+
+        Raises:
+            KeyError: if a token does not exist and the vocab is not a word vocab
+
+        Returns:
+            np.ndarray: ids, shape [len(tokens)] or [len(tokens), len(tokens[0])]
+        """
+        if len(tokens) > 0 and isinstance(tokens[0], (list, tuple)):
+            rows = [self.tokens2ids(row, dtype) for row in tokens]
+            return np.stack(rows) if len(set(len(row) for row in rows)) == 1 else np.array(rows, dtype=object)
+        get = self.item2idx.get
+        ids = np.fromiter((get(token, -1) for token in tokens), dtype=np.int64, count=len(tokens))
+        missing = np.flatnonzero(ids < 0)
+        if len(missing) > 0:
+            if not getattr(self, "is_word", False):
+                token = tokens[missing[0]]
+                print(f"token:{token} does not exist!")
+                raise KeyError()
+            unk_ids = self.unk_ids()
+            lengths = np.fromiter((len(tokens[i]) for i in missing), dtype=np.int64, count=len(missing))
+            ids[missing] = unk_ids[np.where(lengths < len(unk_ids), lengths, 0)]
+        return ids.astype(dtype, copy=False)
+
+    def ids2tokens(self, ids) -> np.ndarray:
+        """ convert ids of any shape to tokens
+
+        Args:
+            ids (array_like): word indexes
+
+        Returns:
+            np.ndarray: object array of tokens with the shape of ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        items = getattr(self, "_items", None)
+        if items is None or len(items) != len(self.idx2item):
+            items = np.empty(len(self.idx2item), dtype=object)
+            items[:] = self.idx2item
+            self._items = items
+        if ids.size > 0 and (ids.min() < 0 or ids.max() >= len(items)):
+            raise ValueError("id out of range")
+        return items[ids]
+
+    def unk_ids(self) -> np.ndarray:
+        """ ids of unknown words by length, unk_ids()[0] is <unk>
+
+        Returns:
+            np.ndarray: id of <unk>{length} for the lengths with their own unk token
+        """
+        unk_ids = getattr(self, "_unk_ids", None)
+        if unk_ids is None:
+            unk_ids = [self.item2idx['<unk>']]
+            while f'<unk>{len(unk_ids)}' in self.item2idx:
+                unk_ids.append(self.item2idx[f'<unk>{len(unk_ids)}'])
+            unk_ids = np.array(unk_ids, dtype=np.int64)
+            self._unk_ids = unk_ids
+        return unk_ids
+
+    def unk_id(self, length: int) -> int:
+        """ get the id of an unknown word
+
+        Args:
+            length (int): the length of the word
+
+        Returns:
+            int: id of <unk>{length}, or <unk> if it does not exist
+        """
+        unk_ids = self.unk_ids()
+        return int(unk_ids[length]) if 0 < length < len(unk_ids) else int(unk_ids[0])
+
     def __add__(self, token: str):
         assert self.item2idx is not None
         assert self.idx2item is not None
@@ -110,6 +177,7 @@ class Vocab():
         self.item2idx[token] = self.size
         self.idx2item.append(token)
         self.size += 1
+        self._unk_ids = None
         return self
 
     def __len__(self):
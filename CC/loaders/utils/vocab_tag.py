@@ -58,14 +58,9 @@ class VocabTag(Vocab):
     def from_files(self, files: List[str], is_word: bool = False, has_default: bool = False, unk_num: str = 0, max_scan_num: int = -1):
         words = []
         for file in files:
-            file_lines = FileUtil.count_lines(file)
-            if max_scan_num != -1:
-                file_lines = min(file_lines, max_scan_num)
-            for index, line in tqdm(enumerate(FileUtil.line_iter(file)), desc="load vocab from files", total=file_lines):
-                if not line:
+            for line in FileReader(file).block_line_iter(max_scan_num):
+                if not line.strip():
                     continue
-                if index >= file_lines:
-                    break
                 data = json.loads(line)
                 words.append((''.join(data[0]), data[1]))
         return self.from_list(words, is_word, has_default, unk_num)
@@ -6,6 +6,7 @@ from CC.LEBert import WCBertModel, BertPreTrainedModel
 from CC.PCBert import PCBertModel
 from CC.crf import CRF
 from CC.birnncrf import BiRnnCrf
+from CC.word_embedding import build_embedding
 from ICCSupervised.ICCSupervised import IModel
 
 
@@ -30,19 +31,21 @@ class CCNERModel(IModel):
         if args['model_name'] in required_label_embedding_models:
             assert "label_embeddings" in args, "argument label_embeddings required"
             self.label_embeddings = args['label_embeddings']
+        self.embedding_dtype = args.get('embedding_dtype', 'float32')
+        self.freeze_embeddings = args.get('freeze_embeddings', False)
         self.load_model()
 
     def load_model(self):
         config = BertConfig.from_json_file(self.bert_config_file_name)
         if self.model_name == 'LEBert':
             self.model = LEBertModel.from_pretrained(
-            self.pretrained_file_name, pretrained_embeddings=self.pretrained_embeddings, config=config)
+            self.pretrained_file_name, pretrained_embeddings=self.pretrained_embeddings, embedding_dtype=self.embedding_dtype, freeze_embeddings=self.freeze_embeddings, config=config)
         elif self.model_name == 'LEBertFusion':
             self.model = LEBertModelFusion.from_pretrained(
-            self.pretrained_file_name, pretrained_embeddings=self.pretrained_embeddings, config=config)
+            self.pretrained_file_name, pretrained_embeddings=self.pretrained_embeddings, embedding_dtype=self.embedding_dtype, freeze_embeddings=self.freeze_embeddings, config=config)
         elif self.model_name == 'PLEBert':
             self.model = PLEBertModel.from_pretrained(
-            self.pretrained_file_name, pretrained_embeddings=self.pretrained_embeddings, label_embeddings=self.label_embeddings, config=config)
+            self.pretrained_file_name, pretrained_embeddings=self.pretrained_embeddings, label_embeddings=self.label_embeddings, embedding_dtype=self.embedding_dtype, freeze_embeddings=self.freeze_embeddings, config=config)
         elif self.model_name == 'Bert':
             self.model = BertBaseModel.from_pretrained(
             self.pretrained_file_name, config=config)
@@ -83,21 +86,19 @@ class LEBertModel(BertPreTrainedModel):
     '''
     config: BertConfig
     pretrained_embeddings: 预训练embeddings shape: size * 200
+    embedding_dtype: float32, float16 or int8
+    freeze_embeddings: do not train the embedding tables, frozen float16 tables are stored in float16
     '''
 
-    def __init__(self, config, pretrained_embeddings):
+    def __init__(self, config, pretrained_embeddings, embedding_dtype="float32", freeze_embeddings=False):
         super().__init__(config)
 
-        word_vocab_size = pretrained_embeddings.shape[0]
-        embed_dim = pretrained_embeddings.shape[1]
-        self.word_embeddings = nn.Embedding(word_vocab_size, embed_dim)
         self.bert = WCBertModel(config)
 
         self.init_weights()
 
         # init the embedding
-        self.word_embeddings.weight.data.copy_(
-            torch.from_numpy(pretrained_embeddings))
+        self.word_embeddings = build_embedding(pretrained_embeddings, embedding_dtype, freeze_embeddings)
         print("Load pretrained embedding from file.........")
 
     def forward(
@@ -129,14 +130,13 @@ class LEBertModelFusion(BertPreTrainedModel):
     '''
     config: BertConfig
     pretrained_embeddings: 预训练embeddings shape: size * 200
+    embedding_dtype: float32, float16 or int8
+    freeze_embeddings: do not train the embedding tables, frozen float16 tables are stored in float16
     '''
 
-    def __init__(self, config, pretrained_embeddings):
+    def __init__(self, config, pretrained_embeddings, embedding_dtype="float32", freeze_embeddings=False):
         super().__init__(config)
 
-        word_vocab_size = pretrained_embeddings.shape[0]
-        embed_dim = pretrained_embeddings.shape[1]
-        self.word_embeddings = nn.Embedding(word_vocab_size, embed_dim)
         self.bert = WCBertModel(config)
 
         self.init_weights()
@@ -153,8 +153,7 @@ class LEBertModelFusion(BertPreTrainedModel):
         self.attn_W.data.normal_(mean=0.0, std=config.initializer_range)
 
         # init the embedding
-        self.word_embeddings.weight.data.copy_(
-            torch.from_numpy(pretrained_embeddings))
+        self.word_embeddings = build_embedding(pretrained_embeddings, embedding_dtype, freeze_embeddings)
         print("Load pretrained embedding from file.........")
 
     def forward(
@@ -208,27 +207,21 @@ class PLEBertModel(BertPreTrainedModel):
     '''
     config: BertConfig
     pretrained_embeddings: 预训练embeddings shape: size * 200
+    label_embeddings: 标签embeddings, 或 ft_loader_v1 的 (word, tag) 句向量表, 由 matched_label_pair_ids 索引
+    embedding_dtype: float32, float16 or int8
+    freeze_embeddings: do not train the embedding tables, frozen float16 tables are stored in float16
     '''
 
-    def __init__(self, config, pretrained_embeddings, label_embeddings):
+    def __init__(self, config, pretrained_embeddings, label_embeddings, embedding_dtype="float32", freeze_embeddings=False):
         super().__init__(config)
 
-        word_vocab_size = pretrained_embeddings.shape[0]
-        embed_dim = pretrained_embeddings.shape[1]
-        self.word_embeddings = nn.Embedding(word_vocab_size, embed_dim)
-
-        label_vocab_size = label_embeddings.shape[0]
-        label_dim = label_embeddings.shape[1]
-        self.label_embeddings = nn.Embedding(label_vocab_size, label_dim)
         self.bert = PCBertModel(config)
 
         self.init_weights()
 
         # init the embedding
-        self.word_embeddings.weight.data.copy_(
-            torch.from_numpy(pretrained_embeddings))
-        self.label_embeddings.weight.data.copy_(
-            torch.from_numpy(label_embeddings))
+        self.word_embeddings = build_embedding(pretrained_embeddings, embedding_dtype, freeze_embeddings)
+        self.label_embeddings = build_embedding(label_embeddings, embedding_dtype, freeze_embeddings)
         print("Load pretrained embedding from file.........")
 
     def forward(
@@ -237,8 +230,9 @@ class PLEBertModel(BertPreTrainedModel):
     ):
         matched_word_embeddings = self.word_embeddings(
             args['matched_word_ids'])
-        matched_label_embeddings = self.label_embeddings(
-            args['matched_label_ids'])
+        # ft_loader_v1 batches index a shared table of (word, tag) embeddings instead of the tags
+        label_ids = args['matched_label_pair_ids'] if 'matched_label_pair_ids' in args else args['matched_label_ids']
+        matched_label_embeddings = self.label_embeddings(label_ids)
         outputs = self.bert(
             input_ids=args['input_ids'],
             attention_mask=args['attention_mask'],
@@ -71,6 +71,9 @@ class NERPreTrainer(ITrainer):
         for epoch in range(self.num_epochs):
             train_count = 0
             train_loss = []
+            if isinstance(self.train_data, StreamingDataset):
+                # workers get a copy of the dataset, the epoch is set here
+                self.train_data.set_epoch(epoch)
             train_iter = tqdm(self.train_iter)
             self.model.train()
             for it in train_iter:
@@ -27,9 +27,13 @@ class NERPredict(IPredict):
             .add_argument("tag_file", str) \
             .add_argument("padding_length", int, 512) \
             .add_argument("num_gpus", list, [0]) \
+            .add_argument("embedding_dtype", str, defaultValue="float32") \
+            .add_argument("freeze_embeddings", bool, defaultValue=False) \
+            .add_argument("dynamic_padding", bool, defaultValue=True) \
             .parse(self, **args)
         args["use_test"] = True
         args["do_predict"] = True
+        args["dynamic_padding"] = self.dynamic_padding
         self.dataloader_init(**args)
         self.model_init()
 
@@ -52,10 +56,10 @@ class NERPredict(IPredict):
         config = BertConfig.from_json_file(self.bert_config_file_name)
         if self.model_name == 'LEBert':
             self.model = LEBertModel(
-                config, pretrained_embeddings=self.vocab_embedding)
+                config, pretrained_embeddings=self.vocab_embedding, embedding_dtype=self.embedding_dtype, freeze_embeddings=self.freeze_embeddings)
         elif self.model_name == 'LEBertFusion':
             self.model = LEBertModelFusion(
-                config, pretrained_embeddings=self.vocab_embedding)
+                config, pretrained_embeddings=self.vocab_embedding, embedding_dtype=self.embedding_dtype, freeze_embeddings=self.freeze_embeddings)
         elif self.model_name == 'Bert':
             self.model = BertBaseModel(config)
 
@@ -126,20 +130,17 @@ class NERPredict(IPredict):
         self.birnncrf.to(device)
 
         if self.loader_name == "le_loader":
-            batch = {}
+            batch = []
             new_sentence = []
             for sentence in sentences:
                 new_sentence.append(list(sentence))
-                it = self.dataloader.loader.myData_test.convert_embedding(
-                    {"text": new_sentence[-1]}, to_tensor=False, return_dict=True)
-                for key in it.keys():
-                    if key not in batch:
-                        batch[key] = []
-                    batch[key].append(it[key])
-            it = batch
+                batch.append(self.dataloader.loader.myData_test.convert_embedding(
+                    {"text": new_sentence[-1]}, to_tensor=False, return_dict=True))
+            it = collate_batch(batch, max_word_num=self.dataloader.loader.max_word_num,
+                               dynamic_padding=self.dynamic_padding)
             with torch.no_grad():
                 for key in it.keys():
-                    it[key] = self.cuda(torch.tensor(it[key]))
+                    it[key] = self.cuda(it[key])
                 outputs = self.model(**it)
                 hidden_states = outputs['mix_output']
                 pred = self.birnncrf(
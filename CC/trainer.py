@@ -41,6 +41,9 @@ class NERTrainer(ITrainer):
         - max_seq_length: optional in `le_loader`, default: 256
         - max_word_num: optional in `le_loader`, default: 5
         - default_tag: optional in `le_loader`, default: "O"
+        - embedding_dtype: optional, float32, float16 or int8, default: "float32"
+        - freeze_embeddings: optional, do not train the word and label embedding tables, default: False
+        - dynamic_padding: optional in LEBert loaders, trim batches to their longest sequence, default: True
         - model_name: optional, default: "LEBert"
         - loader_name: optional, default: "le_loader"
         - task_name: optional, default: None
@@ -55,6 +58,9 @@ class NERTrainer(ITrainer):
         if "loader_name" in args:
             self.loader_name = args["loader_name"]
 
+        if "dynamic_padding" not in args:
+            args["dynamic_padding"] = True
+
         self.eval_data = args['output_eval']
         self.num_epochs = args['num_epochs']
         self.num_gpus = args['num_gpus']
@@ -78,6 +84,10 @@ class NERTrainer(ITrainer):
             model_args['inter_embeddings'] = self.inter_embedding
         if 'pretrained_file_name' in args:
             model_args['pretrained_file_name'] = args['pretrained_file_name']
+        if 'embedding_dtype' in args:
+            model_args['embedding_dtype'] = args['embedding_dtype']
+        if 'freeze_embeddings' in args:
+            model_args['freeze_embeddings'] = args['freeze_embeddings']
         
         self.bert_ner = CCNERModel(**model_args)
         self.model, self.birnncrf = self.bert_ner()
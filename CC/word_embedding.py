@@ -0,0 +1,81 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+EMBEDDING_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "int8": torch.int8
+}
+
+
+class CastEmbedding(nn.Embedding):
+    """Frozen embedding table stored in a compact dtype, looked up rows are cast to the compute dtype.
+    Only built for frozen tables: without a float32 master copy, small optimizer updates of
+    float16 weights underflow and are lost.
+    """
+
+    def __init__(self, num_embeddings, embedding_dim, dtype=torch.float16, output_dtype=torch.float32):
+        super(CastEmbedding, self).__init__(num_embeddings, embedding_dim, dtype=dtype)
+        self.weight.requires_grad_(False)
+        self.output_dtype = output_dtype
+
+    def forward(self, input):
+        return super(CastEmbedding, self).forward(input).to(self.output_dtype)
+
+
+class QuantizedEmbedding(nn.Module):
+    """Frozen embedding table quantized to int8 with a scale per row, rows are dequantized on lookup.
+    :param num_embeddings: size of the table
+    :param embedding_dim: size of each row
+    """
+
+    def __init__(self, num_embeddings, embedding_dim, output_dtype=torch.float32):
+        super(QuantizedEmbedding, self).__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.register_buffer("weight", torch.zeros(num_embeddings, embedding_dim, dtype=torch.int8))
+        self.register_buffer("scale", torch.ones(num_embeddings, dtype=output_dtype))
+
+    def quantize_(self, embeddings):
+        """quantize float rows into the table
+        :param embeddings: [num_embeddings, embedding_dim] float tensor
+        """
+        embeddings = embeddings.to(device=self.scale.device, dtype=torch.float32)
+        scale = embeddings.abs().max(dim=1)[0] / 127
+        scale[scale == 0] = 1
+        self.weight.copy_(torch.round(embeddings / scale.unsqueeze(-1)).clamp(-127, 127))
+        self.scale.copy_(scale)
+        return self
+
+    def forward(self, input):
+        return self.weight[input].to(self.scale.dtype) * self.scale[input].unsqueeze(-1)
+
+    def extra_repr(self):
+        return f"{self.num_embeddings}, {self.embedding_dim}, dtype=int8"
+
+
+def build_embedding(embeddings, dtype="float32", freeze=False):
+    """build an embedding module initialized with pretrained embeddings.
+    a trainable float16 table is upcast to a float32 nn.Embedding, float16 only stays the storage
+    dtype of a frozen table. checkpoints keep the table in its module dtype: a float32 or float16
+    weight, or an int8 weight buffer with a scale buffer. a checkpoint saved with int8 only loads
+    into a model built with int8, and a float checkpoint does not load into an int8 model.
+    :param embeddings: [size, dim] numpy array, e.g. a float16 matrix of the cache
+    :param dtype: storage dtype of the table, one of float32, float16 and int8
+    :param freeze: do not train the table, int8 tables are always frozen
+    :return: nn.Embedding, CastEmbedding for frozen float16 tables, QuantizedEmbedding for int8
+    """
+    assert dtype in EMBEDDING_DTYPES, f"embedding dtype {dtype} not in {list(EMBEDDING_DTYPES)}"
+    size, dim = embeddings.shape
+    embeddings = torch.from_numpy(np.asarray(embeddings))
+    if dtype == "int8":
+        return QuantizedEmbedding(size, dim).quantize_(embeddings)
+    if dtype == "float16" and freeze:
+        embedding = CastEmbedding(size, dim, dtype=torch.float16)
+    else:
+        embedding = nn.Embedding(size, dim)
+        embedding.weight.requires_grad_(not freeze)
+    embedding.weight.data.copy_(embeddings)
+    return embedding
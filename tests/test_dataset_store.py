@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    # CC.loaders.utils imports torch through its collate and sampler modules
+    from CC.loaders.utils.dataset_store import DatasetStore
+    from CC.loaders.utils.reader import FileReader
+except ImportError:
+    DatasetStore = None
+
+
+@unittest.skipIf(DatasetStore is None, "torch is required to import CC.loaders.utils")
+class DatasetStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, "data.json")
+        # the last line has no trailing newline
+        with open(self.file, "w", encoding="utf-8") as f:
+            f.write("\n".join(json.dumps({"text": list("abc"[:i+1])}) for i in range(3)))
+
+    def rows(self):
+        for line in FileReader(self.file).line_iter():
+            text = json.loads(line)["text"]
+            ids = np.zeros(4, dtype=np.int32)
+            ids[:len(text)] = [ord(ch) for ch in text]
+            yield ids, np.arange(len(text), dtype=np.int32)
+
+    def test_unterminated_last_line(self):
+        size = FileReader(self.file).line_size()
+        for path in [None, os.path.join(self.dir, "store")]:
+            fields = DatasetStore.load_or_build(path, ["ids", "lattice"], self.rows, size, ragged=["lattice"])
+            self.assertEqual(len(fields["ids"]), 3)
+            self.assertEqual(len(fields["lattice"]), 3)
+            self.assertEqual(fields["lattice"][2].tolist(), [0, 1, 2])
+
+    def test_rebuild_replaces_store(self):
+        path = os.path.join(self.dir, "store")
+        size = FileReader(self.file).line_size()
+        DatasetStore.load_or_build(path, ["ids"], lambda: ((ids,) for ids, _ in self.rows()), size)
+        fields = DatasetStore.load_or_build(path, ["ids", "lattice"], self.rows, size, ragged=["lattice"])
+        self.assertEqual(fields["lattice"][1].tolist(), [0, 1])
+        self.assertEqual(DatasetStore.load_meta(path)["names"], ["ids", "lattice"])
+        # no temporary directory is left next to the store
+        self.assertEqual([name for name in os.listdir(self.dir) if name.startswith("store")], ["store"])
+
+    def test_too_small_size(self):
+        with self.assertRaises(ValueError):
+            DatasetStore.load_or_build(None, ["ids", "lattice"], self.rows, 2, ragged=["lattice"])
+
+
+if __name__ == "__main__":
+    unittest.main()
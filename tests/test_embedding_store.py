@@ -0,0 +1,30 @@
+import os
+import tempfile
+import unittest
+
+try:
+    # CC.loaders.utils imports torch through its collate and sampler modules
+    from CC.loaders.utils.embedding import WordEmbeddingStore
+except ImportError:
+    WordEmbeddingStore = None
+
+
+@unittest.skipIf(WordEmbeddingStore is None, "torch is required to import CC.loaders.utils")
+class WordEmbeddingStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, "embedding.txt")
+        with open(self.file, "w", encoding="utf-8") as f:
+            f.write("4 2\nx 1 2\nbad 3 oops\ny 5 6\nshort 7\n")
+
+    def test_malformed_values(self):
+        store = WordEmbeddingStore.convert_from_txt(self.file, os.path.join(self.dir, "store"))
+        self.assertEqual(store.words, ["x", "y"])
+        self.assertEqual(store.lines.tolist(), [1, 3])
+        self.assertEqual(store.embedding.tolist(), [[1, 2], [5, 6]])
+        self.assertEqual(store.get_index(), {"x": 0, "y": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from types import SimpleNamespace
+
+try:
+    from CC.loaders.finetune.ftloader_v1 import FTDataSetV1
+    from CC.loaders.utils.lexicon_tree import Trie
+    from CC.loaders.utils.vocab import Vocab
+except ImportError:
+    FTDataSetV1 = None
+
+
+@unittest.skipIf(FTDataSetV1 is None, "torch and transformers are required to import CC.loaders.finetune")
+class FTDataSetV1Test(unittest.TestCase):
+
+    def setUp(self):
+        chars = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "北", "京", "市"]
+        tokenizer = SimpleNamespace(vocab={char: i for i, char in enumerate(chars)}, unk_token="[UNK]")
+        # 北京 is in the lexicon but not in the word vocab, it is matched with an unk id
+        word_vocab = Vocab().from_list(["北京市"], is_word=True, unk_num=5)
+        lexicon_tree = Trie()
+        for word in ["北京", "北京市"]:
+            lexicon_tree.insert(word)
+        lexicon_tree.set_word_ids(word_vocab)
+        self.entity_tag_vocab = Vocab().from_list(["O", "LOC"])
+        external_entities = {"entities": {
+            str(["北", "京"]): {"labels": {"LOC": 1}},
+            str(["北", "京", "市"]): {"labels": {"LOC": 1}},
+        }}
+        self.known_pair = (word_vocab.token2id("北京市"), self.entity_tag_vocab.token2id("LOC"))
+        self.dataset = FTDataSetV1(
+            None, tokenizer, lexicon_tree, word_vocab, Vocab().from_list(["O", "B-LOC", "I-LOC"]),
+            max_word_num=4, max_seq_length=16, default_tag="O", entity_tag_vocab=self.entity_tag_vocab,
+            external_entities=external_entities, max_label_num=2, label_pair_ids={self.known_pair: 1},
+            do_predict=True)
+
+    def test_unk_word_with_labels(self):
+        it = self.dataset.convert_embedding({"text": list("北京市")}, return_dict=True)
+        lattice = it["matched_word_lattice"]
+        pairs = it["matched_label_lattice_pairs"]
+        for row, word_id in enumerate(lattice[:, 2].tolist()):
+            if word_id == self.known_pair[0]:
+                self.assertEqual(pairs[row].tolist(), [1, 0])
+            else:
+                # the unk pair has no row in the pair table, it gathers the zero vector
+                self.assertEqual(pairs[row].tolist(), [0, 0])
+        self.assertIn(self.known_pair[0], lattice[:, 2].tolist())
+        self.assertTrue((it["matched_label_lattice_mask"].sum(axis=1) > 0).any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import tempfile
+import unittest
+
+try:
+    # CC.loaders.utils imports torch through its collate and sampler modules
+    from CC.loaders.utils.reader import FileReader
+except ImportError:
+    FileReader = None
+
+
+@unittest.skipIf(FileReader is None, "torch is required to import CC.loaders.utils")
+class FileReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, "data.txt")
+        with open(self.file, "w", encoding="utf-8") as f:
+            f.write("a\nbb\nccc\n")
+
+    def test_list_line_mapper(self):
+        reader = FileReader(self.file, line_mapper=[0, 2, 5, 9])
+        self.assertEqual(reader.lines([2, 0]), ["ccc\n", "a\n"])
+        self.assertEqual(list(reader.line_range(1, 3)), ["bb\n", "ccc\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()